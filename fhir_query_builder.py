@@ -4,13 +4,13 @@ FHIR Query Builder - TUI Entry Point
 
 A terminal-based interface for building FHIR search queries using AI.
 
-Usage:
+Usage (after installing the project, e.g. `uv sync`):
     python fhir_query_builder.py
     # or
-    python -m fhir_query_builder
+    python -m fhir_qb
 """
 
-from src.fhir_tui import main
+from fhir_qb.fhir_tui import main
 
 if __name__ == "__main__":
     main()
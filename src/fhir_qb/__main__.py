@@ -0,0 +1,5 @@
+"""Run the FHIR Query Builder TUI with `python -m fhir_qb`"""
+
+from .fhir_tui import main
+
+main()
@@ -0,0 +1,1423 @@
+"""
+FHIR AI Query Builder Agents
+
+This module provides AI agents for building FHIR queries:
+- SelectTypesAgent: Selects appropriate FHIR resource types from natural language
+- CreateQueryAgent: Builds valid FHIR search queries for a given resource type
+
+It also includes utilities for fetching FHIR server metadata and search parameters.
+"""
+
+from . import metadata_cache
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pydantic import BaseModel, Field, PrivateAttr, StringConstraints, TypeAdapter, model_validator
+from types import UnionType
+from typing import Annotated, Any, AsyncIterator, Iterator, get_args, get_origin
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from urllib.parse import parse_qsl
+import asyncio
+import importlib
+import os
+import re
+import sys
+import time
+
+try:
+    import orjson
+except ImportError:  # Optional faster JSON parser; fall back to the stdlib
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # Optional streaming JSON parser; fall back to a buffered parse
+    ijson = None
+
+
+# ============================================================================
+# Pydantic Models for FHIR Metadata
+# ============================================================================
+
+# SearchParameter and ResourceMetadata are created thousands of times from trusted
+# server data, so they are slotted dataclasses rather than BaseModels: no per-instance
+# __dict__ and no validation on construction. Pydantic still validates them when
+# FHIRMetadata is loaded from JSON.
+
+@dataclass(slots=True, frozen=True, kw_only=True)
+class SearchParameter:
+    """FHIR search parameter definition"""
+    name: str
+    type: str | None  # Can sometimes be None if special type
+    documentation: str | None = None
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.type}): {self.documentation}"
+
+
+@dataclass(slots=True, frozen=True, kw_only=True)
+class ResourceMetadata:
+    """Metadata for a single FHIR resource type"""
+    type: str
+    profile: str | None = None
+    interactions: list[str]  # ['read', 'search-type', 'create', etc.]
+    search_params: list[SearchParameter]
+    include_values: list[str]
+    revinclude_values: list[str]
+
+
+class FHIRMetadata(BaseModel):
+    """Complete FHIR server metadata response"""
+    searchable_types: list[str] = Field(
+        description="List of resource types that support search-type interaction"
+    )
+    resource_metadata: dict[str, ResourceMetadata] = Field(
+        description="Full metadata for each resource type, keyed by type name"
+    )
+    searchable_types_sorted: list[str] = Field(
+        default_factory=list,
+        description="searchable_types in alphabetical order, precomputed for prompt building"
+    )
+    fhir_version: str | None = None
+    server_url: str
+
+    # CreateQueryAgent system prompts built from this metadata, keyed by target type
+    # and common search params. Not serialized.
+    _create_query_prompts: dict[tuple, str] = PrivateAttr(default_factory=dict)
+    # Per-type search params merged with COMMON_SEARCH_PARAMS and sorted by name,
+    # filled on first use. Not serialized.
+    _merged_search_params: dict[str, list[SearchParameter]] = PrivateAttr(default_factory=dict)
+
+    def same_content(self, other: 'FHIRMetadata | None') -> bool:
+        """Whether other describes the same server capabilities (memoized state is ignored)"""
+        return other is self or (
+            other is not None
+            and self.server_url == other.server_url
+            and self.fhir_version == other.fhir_version
+            and self.resource_metadata == other.resource_metadata
+        )
+
+    @model_validator(mode='after')
+    def _fill_searchable_types_sorted(self) -> 'FHIRMetadata':
+        """Derive the sorted type list when it was not provided (e.g. older cache files)"""
+        if not self.searchable_types_sorted and self.searchable_types:
+            self.searchable_types_sorted = sorted(self.searchable_types)
+        return self
+
+
+# ============================================================================
+# Metadata Cache
+# ============================================================================
+
+DEFAULT_FHIR_SERVER = "https://r4.smarthealthit.org"
+
+METADATA_CACHE_VERSION = 1  # Bump when parsing changes so stale cache files are ignored
+NO_CACHE_ENV_VAR = "FHIR_QB_NO_CACHE"  # Set to a non-empty value to always fetch fresh metadata (e.g. CI)
+
+
+def _cache_key(base_url: str, username: str | None) -> str:
+    """Cache key for a server; entries fetched with credentials are kept per user"""
+    return f"{username}@{base_url}" if username else base_url
+
+
+def _load_cached_metadata(
+    cache_key: str,
+    stale_only: bool = False
+) -> tuple[FHIRMetadata | None, metadata_cache.CacheInfo | None]:
+    """
+    Load cached metadata and its cache info, or (None, None) if missing, unreadable or outdated.
+
+    With stale_only, a fresh entry is returned as (None, info) without parsing it.
+    """
+    data, info = metadata_cache.load(cache_key)
+    if data is None or info is None or info.version != METADATA_CACHE_VERSION:
+        return None, None
+    if stale_only and info.is_fresh():
+        return None, info
+    try:
+        metadata = FHIRMetadata.model_validate_json(data)
+    except ValueError:
+        return None, None
+    return metadata, info
+
+
+def load_cached_metadata(base_url: str, stale_only: bool = False) -> FHIRMetadata | None:
+    """
+    Return the on-disk cached metadata for a server, however old, without any
+    network access. Useful for showing something immediately while
+    fetch_searchable_resources revalidates.
+
+    Args:
+        base_url: FHIR server base URL; only entries fetched without credentials are returned
+        stale_only: Return None for an entry still within its TTL, which
+            fetch_searchable_resources serves itself without network access
+
+    Returns:
+        Cached FHIRMetadata, or None if there is no usable cache entry
+    """
+    return _load_cached_metadata(base_url, stale_only)[0]
+
+
+# ============================================================================
+# Metadata Query Function
+# ============================================================================
+
+# Shared session so repeated fetches reuse pooled connections (and TLS sessions),
+# with backoff retries on transient gateway errors. requests already advertises
+# gzip/deflate, plus br when the optional brotli package is installed.
+_session = requests.Session()
+_session.headers['Accept'] = 'application/fhir+json'
+_retry_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+)
+_session.mount('https://', _retry_adapter)
+_session.mount('http://', _retry_adapter)
+
+STREAM_PARSE_MIN_BYTES = 8 * 1024 * 1024  # Smaller bodies are parsed whole, which is faster
+
+# Resource entry fields read by fetch_searchable_resources; everything else is
+# skipped while streaming the CapabilityStatement
+_RESOURCE_FIELDS = frozenset({
+    'type', 'profile', 'interaction', 'searchParam', 'searchInclude', 'searchRevInclude'
+})
+
+
+class _ChunkReader:
+    """Minimal file-like wrapper so ijson can read from response.iter_content()"""
+
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self._chunks = chunks
+        self._buffer: bytes = b''
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            data, self._buffer = self._buffer + b''.join(self._chunks), b''
+            return data
+        if not self._buffer:
+            self._buffer = next(self._chunks, b'')
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _stream_capability_statement(response: requests.Response) -> dict[str, Any]:
+    """
+    Incrementally parse a CapabilityStatement with ijson, keeping only the parts
+    fetch_searchable_resources reads (fhirVersion, rest[].mode and the used
+    resource fields), so the full document is never held in memory.
+    """
+    statement: dict[str, Any] = {}
+    resource: dict[str, Any] = {}
+    builder = None  # Builds the value of the resource field currently being kept
+    field = ''
+    depth = 0
+
+    try:
+        for prefix, event, value in ijson.parse(_ChunkReader(response.iter_content(64 * 1024))):
+            if builder is not None:
+                builder.event(event, value)
+                if event in ('start_map', 'start_array'):
+                    depth += 1
+                elif event in ('end_map', 'end_array'):
+                    depth -= 1
+                if depth == 0:
+                    resource[field] = builder.value
+                    builder = None
+            elif prefix == 'rest.item.resource.item':
+                if event == 'start_map':
+                    resource = {}
+                    statement['rest'][-1]['resource'].append(resource)
+                elif event == 'map_key' and value in _RESOURCE_FIELDS:
+                    field = value
+                    builder = ijson.ObjectBuilder()
+            elif prefix == 'fhirVersion':
+                statement['fhirVersion'] = value
+            elif prefix == 'rest' and event == 'start_array':
+                statement['rest'] = []
+            elif prefix == 'rest.item' and event == 'start_map':
+                statement['rest'].append({})
+            elif prefix == 'rest.item.mode':
+                statement['rest'][-1]['mode'] = value
+            elif prefix == 'rest.item.resource' and event == 'start_array':
+                statement['rest'][-1]['resource'] = []
+    except ijson.JSONError as e:
+        raise ValueError(f"Invalid CapabilityStatement JSON: {e}") from e
+
+    return statement
+
+
+def _intern(value: str | None) -> str | None:
+    """Intern a heavily repeated string (param types, interaction codes) so instances share it"""
+    return sys.intern(value) if value is not None else None
+
+
+def _parse_resource(resource: dict[str, Any]) -> tuple[str, ResourceMetadata] | None:
+    """
+    Parse one CapabilityStatement resource entry.
+
+    Returns (type, ResourceMetadata), or None if the entry has no type or does
+    not support the search-type interaction.
+    """
+    resource_type = resource.get('type')
+    if not resource_type:
+        return None
+
+    # Check if resource supports search-type interaction (reference line 74-79)
+    interactions = resource.get('interaction', ())
+    if not any(i.get('code') == 'search-type' for i in interactions):
+        return None
+
+    # Parse search parameters and sort alphabetically (reference line 81-90).
+    # searchParam.name is required (1..1) by the FHIR spec, so index it directly.
+    search_params = [
+        SearchParameter(
+            name=p['name'],
+            type=_intern(p.get('type')),
+            documentation=p.get('documentation')
+        )
+        for p in resource.get('searchParam', ())
+    ]
+    search_params.sort(key=lambda p: p.name)
+
+    # Include lists are pre-sorted for prompt building
+    return resource_type, ResourceMetadata(
+        type=resource_type,
+        profile=resource.get('profile'),
+        interactions=[_intern(i.get('code')) for i in interactions],
+        search_params=search_params,
+        include_values=sorted(resource.get('searchInclude', ())),
+        revinclude_values=sorted(resource.get('searchRevInclude', ()))
+    )
+
+
+def _read_capability_statement(response: requests.Response) -> dict[str, Any]:
+    """
+    Decode the CapabilityStatement body with the best available parser.
+
+    orjson is the fastest. ijson keeps memory flat but costs several times the
+    CPU of either full parser, so without orjson it is only used for bodies
+    declared larger than STREAM_PARSE_MIN_BYTES.
+    """
+    if orjson is not None:
+        return orjson.loads(response.content)
+    if ijson is not None and int(response.headers.get('Content-Length') or 0) > STREAM_PARSE_MIN_BYTES:
+        return _stream_capability_statement(response)
+    return response.json()
+
+def fetch_searchable_resources(
+    base_url: str = DEFAULT_FHIR_SERVER,
+    username: str | None = None,
+    password: str | None = None,
+    use_cache: bool | None = None,
+    refresh: bool = False
+) -> FHIRMetadata:
+    """
+    Fetch searchable resource types from FHIR server metadata.
+
+    Based on reference code that queries /metadata endpoint and filters
+    resources with 'search-type' interaction capability.
+
+    Parsed metadata is cached on disk (see metadata_cache) together with the
+    response's ETag and Last-Modified headers. Entries younger than the cache TTL are returned
+    without touching the network; older ones are revalidated with a conditional
+    request, and a 304 Not Modified returns the cached metadata without re-parsing.
+    With credentials, the server is always asked (conditionally, with auth) so a
+    cached copy is never served to a caller the server would reject.
+
+    Args:
+        base_url: FHIR server base URL (default: SMART Health IT R4 server)
+        username: Optional username for basic authentication
+        password: Optional password for basic authentication
+        use_cache: Whether to read from and write to the on-disk metadata cache;
+            None (default) means yes unless FHIR_QB_NO_CACHE is set
+        refresh: Always go to the server, even if a fresh cache entry
+            exists; also asks intermediary caches to revalidate (Cache-Control: max-age=0)
+
+    Returns:
+        FHIRMetadata: Pydantic model containing searchable types and full resource metadata
+
+    Raises:
+        requests.RequestException: If network request fails
+        ValueError: If response is invalid or missing required fields
+    """
+    # Query metadata endpoint
+    metadata_url = f"{base_url}/metadata"
+
+    # Prepare auth if credentials provided
+    auth = None
+    if username and password:
+        from requests.auth import HTTPBasicAuth
+        auth = HTTPBasicAuth(username, password)
+
+    if use_cache is None:
+        use_cache = not os.environ.get(NO_CACHE_ENV_VAR)
+
+    # Revalidate a cached copy with conditional request headers
+    cache_key = _cache_key(base_url, username)
+    cached, cache_info = _load_cached_metadata(cache_key) if use_cache else (None, None)
+    if (
+        cached is not None and cache_info is not None and not refresh
+        and cache_info.is_fresh() and username is None and password is None
+    ):
+        return cached
+
+    headers: dict[str, str] = {}
+    if cache_info is not None:
+        if cache_info.etag:
+            headers['If-None-Match'] = cache_info.etag
+        if cache_info.last_modified:
+            headers['If-Modified-Since'] = cache_info.last_modified
+    if refresh:
+        headers['Cache-Control'] = 'max-age=0'
+
+    try:
+        with _session.get(
+            metadata_url, auth=auth, headers=headers, timeout=(3.05, 10), stream=True
+        ) as response:
+            if response.status_code == 304 and cached is not None and cache_info is not None:
+                metadata_cache.touch(cache_key, cache_info)
+                return cached
+            response.raise_for_status()
+            capability_statement = _read_capability_statement(response)
+    except requests.RequestException as e:
+        raise requests.RequestException(f"Failed to fetch metadata from {metadata_url}: {e}")
+
+    # Validate response structure
+    if not capability_statement.get('rest') or len(capability_statement['rest']) == 0:
+        raise ValueError("Invalid CapabilityStatement: missing 'rest' array")
+
+    if not capability_statement['rest'][0].get('resource'):
+        raise ValueError("Invalid CapabilityStatement: missing 'resource' array in rest[0]")
+
+    server_capability_metadata = next(
+        (x for x in capability_statement['rest'] if x['mode'] == "server"),
+        None  # default value if not found
+    )
+    if server_capability_metadata is None:
+        raise ValueError("FHIR server does not expose capability information")
+
+    # Extract searchable resources (matching reference code logic)
+    resource_metadata: dict[str, ResourceMetadata] = dict(
+        filter(None, map(_parse_resource, server_capability_metadata['resource']))
+    )
+    searchable_types = list(resource_metadata)
+
+    metadata = FHIRMetadata(
+        searchable_types=searchable_types,
+        resource_metadata=resource_metadata,
+        searchable_types_sorted=sorted(searchable_types),
+        fhir_version=capability_statement.get('fhirVersion'),
+        server_url=base_url
+    )
+
+    if use_cache:
+        metadata_cache.store(cache_key, metadata.model_dump_json(), metadata_cache.CacheInfo(
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            version=METADATA_CACHE_VERSION,
+            fetched_at=time.time()
+        ))
+
+    return metadata
+
+
+async def fetch_searchable_resources_async(
+    base_url: str = DEFAULT_FHIR_SERVER,
+    username: str | None = None,
+    password: str | None = None,
+    use_cache: bool | None = None,
+    refresh: bool = False
+) -> FHIRMetadata:
+    """
+    Async version of fetch_searchable_resources.
+
+    The blocking fetch runs in a worker thread so the caller's event loop stays
+    free; arguments and behavior are otherwise identical.
+    """
+    return await asyncio.to_thread(
+        fetch_searchable_resources, base_url, username, password, use_cache, refresh
+    )
+
+
+# ============================================================================
+# Utility Functions
+# ============================================================================
+
+def merge_search_params(
+    resource_params: list[SearchParameter],
+    common_search_params: list[SearchParameter]
+) -> list[SearchParameter]:
+    """
+    Combine a resource's search parameters with common ones, sorted by name.
+
+    Common parameters already declared by the resource are skipped so the
+    server's definition wins.
+    """
+    resource_param_names = {p.name for p in resource_params}
+    merged = resource_params + [
+        p for p in common_search_params if p.name not in resource_param_names
+    ]
+    merged.sort(key=lambda p: p.name)
+    return merged
+
+
+def get_search_parameters(
+    resource_type: str,
+    metadata: FHIRMetadata
+) -> list[SearchParameter]:
+    """
+    Get available search parameters for a specific FHIR resource type.
+
+    Args:
+        resource_type: The FHIR resource type name (e.g., 'Patient', 'Observation')
+        metadata: FHIRMetadata object containing cached resource metadata
+
+    Returns:
+        List of SearchParameter objects for the given resource type
+
+    Raises:
+        ValueError: If resource_type is not found in metadata
+    """
+    if resource_type not in metadata.resource_metadata:
+        available_types = ', '.join(metadata.searchable_types_sorted[:10])
+        raise ValueError(
+            f"Resource type '{resource_type}' not found in metadata. "
+            f"Available types include: {available_types}..."
+        )
+
+    return metadata.resource_metadata[resource_type].search_params
+
+
+# ============================================================================
+# Prompt Caching
+# ============================================================================
+
+# Agent system prompts (and the output tools before them) are marked for Anthropic
+# prompt caching, so repeat calls with the same prompt read the prefix from cache
+# instead of paying full input price. Prompts below the model's minimum cacheable
+# length are simply sent uncached.
+PROMPT_CACHE_TTL = '5m'
+
+
+# ============================================================================
+# Message Batches API
+# ============================================================================
+
+# Non-interactive callers (e.g. `pytest --llm-batch`) can submit prompts through
+# Anthropic's Message Batches API, which is billed at half the regular price but
+# may take minutes (up to 24h) to finish.
+BATCH_API_POLL_SECONDS = 30
+BATCH_API_TIMEOUT_SECONDS = 60 * 60  # Most batches finish within an hour; give up rather than block for 24h
+BATCH_API_MAX_TOKENS = 4096
+
+
+def _batch_output_tools(output_type: Any) -> dict[str, tuple[TypeAdapter, bool]]:
+    """
+    Build one output tool per member of an agent's output_type.
+
+    Returns:
+        Dict mapping tool name to (TypeAdapter, wrapped); wrapped tools carry a
+        non-object output (e.g. a list) under a "response" key, as pydantic-ai does
+    """
+    tools = {}
+    members = get_args(output_type) if isinstance(output_type, UnionType) else (output_type,)
+    for member in members:
+        if get_origin(member) is list:
+            name = f"final_result_{get_args(member)[0].__name__}List"
+        else:
+            name = f"final_result_{member.__name__}"
+        tools[name] = (TypeAdapter(member), get_origin(member) is list)
+    return tools
+
+
+def _parse_batch_result(entry: Any, output_tools: dict[str, tuple[TypeAdapter, bool]]) -> Any:
+    """
+    Validate the output tool call of one Message Batches result entry.
+
+    Args:
+        entry: Result entry from client.messages.batches.results
+        output_tools: Output tools from _batch_output_tools
+
+    Returns:
+        The validated output
+
+    Raises:
+        RuntimeError: If the request did not succeed
+        ValueError: If the response has no usable output tool call
+    """
+    if entry.result.type != "succeeded":
+        raise RuntimeError(f"Batch request {entry.custom_id} {entry.result.type}")
+    tool_call = next(
+        (block for block in entry.result.message.content
+         if block.type == "tool_use" and block.name in output_tools),
+        None
+    )
+    if tool_call is None:
+        raise ValueError(f"Batch request {entry.custom_id} returned no output tool call")
+    adapter, wrapped = output_tools[tool_call.name]
+    if wrapped and "response" not in tool_call.input:
+        raise ValueError(f"Batch request {entry.custom_id} output has no response field")
+    return adapter.validate_python(tool_call.input["response"] if wrapped else tool_call.input)
+
+
+def run_message_batch(
+    model_name: str,
+    system_prompt: str,
+    prompts: list[str],
+    output_type: Any,
+    poll_interval: float = BATCH_API_POLL_SECONDS,
+    timeout: float = BATCH_API_TIMEOUT_SECONDS
+) -> list[Any]:
+    """
+    Run prompts through the Anthropic Message Batches API and parse their outputs.
+
+    Each prompt becomes its own request with the same system prompt and output
+    tools, so results match what the agent would return for a single run.
+
+    Args:
+        model_name: Anthropic model name (e.g., 'claude-opus-4-5')
+        system_prompt: Agent system prompt shared by all requests
+        prompts: User prompts, one request each
+        output_type: Agent output type; a union becomes one tool per member
+        poll_interval: Seconds between batch status checks
+        timeout: Seconds to wait for the batch before canceling it
+
+    Returns:
+        Parsed outputs, one per prompt, in the same order
+
+    Raises:
+        TimeoutError: If the batch has not ended within timeout (it is canceled)
+        RuntimeError: If a request in the batch did not succeed
+        ValueError: If a response has no usable output tool call
+    """
+    import anthropic
+
+    output_tools = _batch_output_tools(output_type)
+    tools = []
+    for name, (adapter, wrapped) in output_tools.items():
+        schema = adapter.json_schema()
+        if wrapped:
+            defs = schema.pop("$defs", None)
+            schema = {"type": "object", "properties": {"response": schema}, "required": ["response"]}
+            if defs:
+                schema["$defs"] = defs
+        tools.append({"name": name, "description": "The final response", "input_schema": schema})
+
+    client = anthropic.Anthropic()
+    batch = client.messages.batches.create(requests=[
+        {
+            "custom_id": f"prompt-{i}",
+            "params": {
+                "model": model_name,
+                "max_tokens": BATCH_API_MAX_TOKENS,
+                "system": [{
+                    "type": "text",
+                    "text": system_prompt,
+                    "cache_control": {"type": "ephemeral", "ttl": PROMPT_CACHE_TTL},
+                }],
+                "messages": [{"role": "user", "content": prompt}],
+                "tools": tools,
+                "tool_choice": {"type": "any"},
+            },
+        }
+        for i, prompt in enumerate(prompts)
+    ])
+    deadline = time.monotonic() + timeout
+    while batch.processing_status != "ended":
+        if time.monotonic() >= deadline:
+            client.messages.batches.cancel(batch.id)
+            raise TimeoutError(f"Batch {batch.id} did not finish within {timeout:.0f}s and was canceled")
+        time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+        batch = client.messages.batches.retrieve(batch.id)
+
+    outputs: list[Any] = [None] * len(prompts)
+    for entry in client.messages.batches.results(batch.id):
+        outputs[int(entry.custom_id.removeprefix("prompt-"))] = _parse_batch_result(entry, output_tools)
+    return outputs
+
+
+# ============================================================================
+# Select Types Agent Models
+# ============================================================================
+
+class SelectedResourceType(BaseModel):
+    """A single selected FHIR resource type with confidence and reasoning"""
+    selected_type: str = Field(
+        description="The selected resource type name"
+    )
+    confidence: float = Field(
+        ge=0.0,
+        le=1.0,
+        description="Confidence score (0.0-1.0) for this selection"
+    )
+    reasoning: str = Field(
+        description="Explanation of why this type was selected"
+    )
+
+
+class SelectTypeError(BaseModel):
+    """Error result when type selection fails"""
+    error: str = Field(
+        description="Error message describing what went wrong"
+    )
+    reasoning: str = Field(
+        description="Explanation of why the selection failed"
+    )
+
+
+# ============================================================================
+# Select Types Agent Class
+# ============================================================================
+
+class SelectTypesAgent:
+    """Agent for selecting FHIR resource types from natural language queries"""
+
+    def __init__(self, metadata: FHIRMetadata) -> None:
+        """
+        Initialize the agent with FHIR server metadata.
+
+        Args:
+            metadata: FHIRMetadata object containing available searchable types
+        """
+        # pydantic_ai is imported lazily so metadata-only callers don't pay for it
+        from pydantic_ai import Agent
+        from pydantic_ai.models.anthropic import AnthropicModel, AnthropicModelSettings
+
+        self.metadata = metadata
+        self.model = AnthropicModel('claude-opus-4-5')
+
+        # Create agent that returns a list of SelectedResourceType or SelectTypeError
+        self.agent = Agent(
+            model=self.model,
+            output_type=list[SelectedResourceType] | SelectTypeError,
+            system_prompt=self._build_system_prompt(),
+            model_settings=AnthropicModelSettings(anthropic_cache_instructions=PROMPT_CACHE_TTL)
+        )
+
+    def select_types(self, query: str) -> list[SelectedResourceType] | SelectTypeError:
+        """
+        Analyze query and return selected resource types.
+
+        Args:
+            query: Natural language query from user
+
+        Returns:
+            List of SelectedResourceType (with individual confidence/reasoning)
+            or SelectTypeError if selection fails
+        """
+        result = self.agent.run_sync(query)
+        return result.output
+
+    async def select_types_async(self, query: str) -> list[SelectedResourceType] | SelectTypeError:
+        """
+        Async version of select_types for callers that already run an event loop.
+
+        Args:
+            query: Natural language query from user
+
+        Returns:
+            List of SelectedResourceType (with individual confidence/reasoning)
+            or SelectTypeError if selection fails
+        """
+        result = await self.agent.run(query)
+        return result.output
+
+    def select_types_via_batch_api(
+        self,
+        queries: list[str]
+    ) -> list[list[SelectedResourceType] | SelectTypeError]:
+        """
+        Select types for several queries through the Message Batches API.
+
+        Cheaper than select_types but may take minutes; meant for non-interactive runs.
+
+        Args:
+            queries: Natural language queries
+
+        Returns:
+            One selection result per query, in the same order
+        """
+        return run_message_batch(
+            self.model.model_name, self._build_system_prompt(), queries,
+            list[SelectedResourceType] | SelectTypeError
+        )
+
+    def _build_system_prompt(self) -> str:
+        """Build dynamic system prompt with available types from metadata"""
+        types_list = "\n".join(self.metadata.searchable_types_sorted)
+
+        return f"""You are a FHIR resource type selector. Analyze user queries and select the appropriate FHIR resource type(s).
+
+Available searchable resource types ({len(self.metadata.searchable_types)} total):
+{types_list}
+
+Your task:
+1. Analyze the user's query to understand what data they want
+2. Select the most appropriate resource type(s) from the available list above
+3. Return a list of SelectedResourceType objects, each with:
+   - selected_type: the resource type name
+   - confidence: your confidence score for this specific type (0.0-1.0)
+   - reasoning: why this specific type was selected
+4. Order results by relevance (most relevant first)
+
+Confidence scoring guidelines (per type):
+- 0.9-1.0: Exact type name mentioned or very clear semantic match
+- 0.7-0.9: Clear semantic match with good context
+- 0.5-0.7: Reasonable match but some ambiguity
+- 0.3-0.5: Multiple valid options, this is one possibility
+- 0.0-0.3: Very uncertain, weak match
+
+Common mappings:
+- "patients", "patient demographics", "people" → Patient
+- "vital signs", "blood pressure", "lab results", "observations" → Observation
+- "medications", "prescriptions", "drugs" → Medication, MedicationRequest
+- "encounters", "visits", "appointments" → Encounter
+- "procedures", "surgeries", "operations" → Procedure
+- "conditions", "diagnoses", "problems", "diseases" → Condition
+- "allergies" → AllergyIntolerance
+- "immunizations", "vaccinations" → Immunization
+
+Error handling:
+- If requested type doesn't exist in available list: return a SelectTypeError with error message and reasoning
+- If type exists but query is ambiguous: return multiple SelectedResourceType objects, each with their own confidence
+- If query is too vague: return most likely types with lower confidence scores
+
+IMPORTANT:
+- Only select types from the available list above
+- Each SelectedResourceType in your list should have its own reasoning explaining why THAT specific type matches
+- For ambiguous queries, return multiple types with individual confidence scores
+- If NO valid types can be found, return a single SelectTypeError
+
+Examples:
+- "Find patients" → [SelectedResourceType(selected_type="Patient", confidence=0.95, reasoning="Direct match...")]
+- "Get medication data" → [
+    SelectedResourceType(selected_type="Medication", confidence=0.7, reasoning="Could be medication definitions..."),
+    SelectedResourceType(selected_type="MedicationRequest", confidence=0.8, reasoning="Most likely prescription orders..."),
+  ]
+- "Find XYZ" → [SelectTypeError(error="Type 'XYZ' not found", reasoning="...")]"""
+
+
+# ============================================================================
+# Common Search Parameters
+# ============================================================================
+
+COMMON_SEARCH_PARAMS = [
+    SearchParameter(
+        name="_id",
+        type="token",
+        documentation="The logical id of the resource (e.g., _id=123)"
+    ),
+    SearchParameter(
+        name="_lastUpdated",
+        type="date",
+        documentation="When the resource was last changed (e.g., _lastUpdated=gt2023-01-01)"
+    ),
+    SearchParameter(
+        name="_tag",
+        type="token",
+        documentation="Tags applied to this resource in Resource.meta.tag"
+    ),
+    SearchParameter(
+        name="_profile",
+        type="reference",
+        documentation="Profiles this resource claims to conform to in Resource.meta.profile"
+    ),
+    SearchParameter(
+        name="_security",
+        type="token",
+        documentation="Security labels applied to this resource in Resource.meta.security"
+    ),
+    SearchParameter(
+        name="_source",
+        type="uri",
+        documentation="Identifies the source system in Resource.meta.source"
+    ),
+    SearchParameter(
+        name="_language",
+        type="token",
+        documentation="Language of the resource content"
+    ),
+    SearchParameter(
+        name="_text",
+        type="string",
+        documentation="Search on the narrative text of the resource (special)"
+    ),
+    SearchParameter(
+        name="_content",
+        type="string",
+        documentation="Search on the entire content of the resource (special)"
+    ),
+    SearchParameter(
+        name="_list",
+        type="special",
+        documentation="Search resources referenced by a List resource"
+    ),
+    SearchParameter(
+        name="_has",
+        type="special",
+        documentation="Reverse chaining - select resources based on properties of resources that refer to them. Examples: GET /Patient?_has:Observation:patient:code=1234-5 (Patients who have an Observation with code 1234-5), GET /Practitioner?_has:MedicationRequest:requester:_id=* (Practitioners who have authored any MedicationRequest)"
+    ),
+    SearchParameter(
+        name="_type",
+        type="special",
+        documentation="Filter by resource type (used in system-level searches)"
+    ),
+    SearchParameter(
+        name="_in",
+        type="reference",
+        documentation="Test membership in CareTeam, Group, or List"
+    ),
+    SearchParameter(
+        name="_filter",
+        type="special",
+        documentation="Advanced filter expression (FHIRPath-like syntax)"
+    ),
+    SearchParameter(
+        name="_query",
+        type="special",
+        documentation="Invoke a named/custom query operation"
+    ),
+    SearchParameter(
+        name="_sort",
+        type="string",
+        documentation="Comma-separated list of sort rules. Prefix with - for descending order. Example: _sort=-date,status"
+    ),
+    SearchParameter(
+        name="_count",
+        type="number",
+        documentation="Number of results per page. Example: _count=10"
+    ),
+    SearchParameter(
+        name="_include",
+        type="special",
+        documentation="Include referenced resources in results. Syntax: _include=[Resource]:[searchParam] or [Resource]:[searchParam]:[targetType] or *. Example: _include=Observation:patient"
+    ),
+    SearchParameter(
+        name="_revinclude",
+        type="special",
+        documentation="Include resources that reference the matches (reverse include). Syntax: _revinclude=[Resource]:[searchParam] or [Resource]:[searchParam]:[targetType] or *. Example: _revinclude=Provenance:target"
+    ),
+    SearchParameter(
+        name="_summary",
+        type="code",
+        documentation="Return summary view: true, false, text, count, data"
+    ),
+    SearchParameter(
+        name="_elements",
+        type="string",
+        documentation="Comma-separated list of elements to return. Example: _elements=identifier,name,birthDate"
+    ),
+    SearchParameter(
+        name="_contained",
+        type="code",
+        documentation="How to handle contained resources: true, false, both"
+    ),
+    SearchParameter(
+        name="_containedType",
+        type="code",
+        documentation="What to return when contained matches: container, contained"
+    ),
+    SearchParameter(
+        name="_total",
+        type="code",
+        documentation="Request total count precision: none, estimate, accurate"
+    ),
+    SearchParameter(
+        name="_maxresults",
+        type="number",
+        documentation="Maximum total results to return across all pages"
+    ),
+    SearchParameter(
+        name="_score",
+        type="boolean",
+        documentation="Whether to include relevance scores (true/false)"
+    ),
+    SearchParameter(
+        name="_graph",
+        type="reference",
+        documentation="Reference to a GraphDefinition for structured includes"
+    )
+]
+
+
+# ============================================================================
+# FHIR Search Syntax Summary
+# ============================================================================
+
+SYNTAX_SUMMARY_PROMPT = """# Syntax Considerations
+## Chaining (Using . in Parameter Names)
+Chaining allows searching on properties of referenced resources:
+
+# Observations where the patient's name is "Smith"
+GET /Observation?patient.name=Smith
+
+# Observations where the patient has MRN 12345
+GET /Observation?patient.identifier=http://hospital.org/mrn|12345
+
+# With type disambiguation (when reference can be multiple types)
+GET /Observation?subject:Patient.name=Smith
+
+# Multiple levels of chaining
+GET /DiagnosticReport?result.subject.name=Smith
+
+## Combining Parameters (AND vs OR)
+AND (intersection): Repeat the parameter or use different parameters
+# Patient with given name "John" AND family name "Smith"
+GET /Patient?given=John&family=Smith
+
+OR (union): Use comma-separated values
+# Patients with given name "John" OR "Jane"
+GET /Patient?given=John,Jane
+
+# How to Use Each Type:
+1. Number
+Searching on a simple numerical value in a resource. Values can include precision (e.g., 100 vs 100.00) and support exponential notation (e.g., 1e2). Supports prefixes: eq, ne, lt, le, gt, ge, sa, eb, ap.
+Examples:
+* [parameter]=100 — values equal to 100 (within precision)
+* [parameter]=lt100 — values less than 100
+* [parameter]=ge100 — values greater than or equal to 100
+2. Date
+A date parameter searches on date/time or period. The format is yyyy-mm-ddThh:mm:ss.ssss[Z|(+|-)hh:mm]. Date searches are intrinsically matches against periods. Supports the same prefixes as number parameters.
+Examples:
+* [parameter]=eq2013-01-14 — date is January 14, 2013
+* [parameter]=ge2013-03-14 — date is on or after March 14, 2013
+* [parameter]=lt2013-01-14T10:00 — before 10:00 on January 14, 2013
+3. String
+For a simple string search, a string parameter serves as input for a search against sequences of characters. This search is insensitive to casing and combining characters like accents. By default, a field matches if the value equals or starts with the supplied parameter value.
+Modifiers:
+* :contains — matches anywhere in the string
+* :exact — case-sensitive exact match
+Examples:
+* given=eve — matches "Eve", "Evelyn"
+* given:contains=eve — matches "Eve", "Evelyn", "Severine"
+* given:exact=Eve — matches only "Eve" (case-sensitive)
+4. Token
+A token type provides a close to exact match search on a string of characters, potentially scoped by a URI. It is mostly used against code or identifier datatypes where the value may have a URI that scopes its meaning. Matches are literal and case sensitive unless the underlying semantics indicate otherwise.
+Syntax:
+* [parameter]=[code] — matches code regardless of system
+* [parameter]=[system]|[code] — matches code within specific system
+* [parameter]=|[code] — matches code with no system
+* [parameter]=[system]| — matches any code in the system
+Modifiers: :text, :not, :above, :below, :in, :not-in, :of-type
+Examples:
+* identifier=http://acme.org/patient|2345
+* gender=male
+* code:below=http://snomed.info/sct|235862008 — subsumption search
+5. Reference
+A reference parameter refers to references between resources. The interpretation is either: [id] (logical id), [type]/[id] (typed logical id), or [url] (absolute URL).
+Modifiers: :[type], :identifier, :above, :below
+Examples:
+* subject=Patient/23
+* subject:Patient=23
+* subject:identifier=http://example.org/mrn|12345
+6. Quantity
+A quantity parameter searches on the Quantity datatype. The syntax is [prefix][number]|[system]|[code].
+Examples:
+* value-quantity=5.4|http://unitsofmeasure.org|mg — 5.4 mg (UCUM)
+* value-quantity=5.4||mg — 5.4 mg (any system)
+* value-quantity=le5.4|http://unitsofmeasure.org|mg — ≤5.4 mg
+7. URI
+The uri parameter refers to an element containing a URI. By default, matches are precise, case and accent sensitive, and the entire URI must match. The modifiers :above or :below can be used for partial matching.
+Examples:
+* url=http://acme.org/fhir/ValueSet/123
+* url:below=http://acme.org/fhir — matches URLs starting with this path
+8. Composite
+Composite search parameters allow joining multiple elements into distinct single values with a $. This allows searches based on tuples of values, which is different from simple intersection.
+Examples:
+* code-value-quantity=http://loinc.org|2823-3$gt5.4|http://unitsofmeasure.org|mmol/L
+* characteristic-value=gender$mixed
+9. Special
+A few parameters have the type 'special', indicating the way this parameter works is unique to the parameter and described with the parameter. The general modifiers and comparators do not apply except as stated in the description.
+
+Common Prefixes (for number, date, quantity)
+eq: Equal (default)
+ne: Not equal
+gt: Greater than
+lt: Less than
+ge: Greater than or equal
+le: Less than or equal
+sa: Starts after
+eb: Ends before
+ap: Approximately (~10%)
+
+Common Modifiers
+:missing (All single-element types): Filter by presence/absence of value
+:exact (string): Case-sensitive exact match
+:contains (string, uri): Match anywhere in value
+:text (token, reference): String match on display text
+:not (token): Negation
+:above (token, reference, uri): Hierarchical/subsumption search (ancestors)
+:below (token, reference, uri): Hierarchical/subsumption search (descendants)
+:in (token): Value is in specified ValueSet
+:not-in (token): Value is not in specified ValueSet
+:identifier (reference): Match on Reference.identifier
+:[type] (reference): Restrict reference to specific resource type
+:of-type (token): Match identifier by type code and value
+"""
+
+
+# ============================================================================
+# Create Query Agent Models
+# ============================================================================
+
+class CreateQueryOutput(BaseModel):
+    """Generated query string"""
+    query_string: Annotated[
+        str,
+        StringConstraints(
+            min_length=1,
+            strip_whitespace=True,
+        ),
+        Field(
+            description="The FHIR search query string to append to the resource endpoint",
+            examples=["name=John&birthdate=gt1990-01-01"]
+        )
+    ]
+
+
+class CreateQueryError(BaseModel):
+    """Error result when query creation fails"""
+    error: str = Field(
+        description="Error message describing what went wrong"
+    )
+    suggestion: str | None = Field(
+        default=None,
+        description="Suggested alternative approaches or corrections"
+    )
+
+
+# ============================================================================
+# Create Query Agent Class
+# ============================================================================
+
+def _compose_create_query_prompt(
+    target_type: str,
+    search_params: list[SearchParameter],
+    include_values: list[str],
+    revinclude_values: list[str]
+) -> str:
+    """
+    Assemble the CreateQueryAgent system prompt.
+
+    The large SYNTAX_SUMMARY_PROMPT constant is joined in by reference rather
+    than interpolated into an f-string with the per-type sections.
+    """
+    search_params_str = "\n".join(f"  - {param}" for param in search_params)
+    include_values_str = "\n".join(f"  - {val}" for val in include_values)
+    revinclude_values_str = "\n".join(f"  - {val}" for val in revinclude_values)
+
+    header = f"""You are a FHIR query builder. Build a valid FHIR search query string for the '{target_type}' resource type.
+
+TARGET RESOURCE TYPE: {target_type}
+
+AVAILABLE SEARCH PARAMETERS ({len(search_params)} total):
+{search_params_str}
+
+AVAILABLE _include VALUES ({len(include_values)} total):
+{include_values_str}
+
+AVAILABLE _revinclude VALUES ({len(revinclude_values)} total):
+{revinclude_values_str}"""
+
+    footer = f"""Your task:
+1. Analyze the user's query to understand what data they want to search for
+2. Select appropriate search parameters from the available list above
+3. Build a valid FHIR search query string using the correct syntax
+4. Use appropriate modifiers, prefixes, and combinators based on the parameter types
+5. Return the complete query string that can be appended to /{target_type}?
+6. If a correct, valid query string cannot be generated for some reason, output the error. If there is not enough information to ouput a valid query string, you must output an error.
+
+IMPORTANT:
+- Only use search parameters from the available list above
+- Follow FHIR R4 search syntax rules
+- Use correct parameter types and modifiers
+"""
+
+    return "\n\n".join((header, SYNTAX_SUMMARY_PROMPT, footer))
+
+
+def _available_search_params(
+    target_type: str,
+    metadata: FHIRMetadata,
+    common_search_params: list[SearchParameter]
+) -> list[SearchParameter]:
+    """
+    Return the resource's search params merged with the common ones.
+
+    Raises:
+        ValueError: If target_type is not found in metadata
+    """
+    target_type_metadata = metadata.resource_metadata.get(target_type, None)
+    if target_type_metadata is None:
+        raise ValueError(f"Target type {target_type} not found in metadata")
+
+    # The per-type index is only kept for COMMON_SEARCH_PARAMS; merge by hand
+    # if a different list was given
+    if common_search_params is not COMMON_SEARCH_PARAMS:
+        return merge_search_params(target_type_metadata.search_params, common_search_params)
+    merged = metadata._merged_search_params.get(target_type)
+    if merged is None:
+        merged = metadata._merged_search_params[target_type] = merge_search_params(
+            target_type_metadata.search_params, common_search_params
+        )
+    return merged
+
+
+def _create_query_system_prompt(
+    target_type: str,
+    metadata: FHIRMetadata,
+    common_search_params: list[SearchParameter]
+) -> str:
+    """
+    Return the CreateQueryAgent system prompt for a resource type.
+
+    Prompts are memoized on the metadata object, keyed by target type and the
+    common search params, so they are built once per type.
+
+    Raises:
+        ValueError: If target_type is not found in metadata
+    """
+    key = (
+        target_type,
+        tuple((p.name, p.type, p.documentation) for p in common_search_params)
+    )
+    prompt = metadata._create_query_prompts.get(key)
+    if prompt is not None:
+        return prompt
+
+    available_search_params = _available_search_params(target_type, metadata, common_search_params)
+    target_type_metadata = metadata.resource_metadata[target_type]
+
+    # Already sorted by fetch_searchable_resources; never mutate the shared metadata here
+    prompt = metadata._create_query_prompts[key] = _compose_create_query_prompt(
+        target_type,
+        available_search_params,
+        target_type_metadata.include_values,
+        target_type_metadata.revinclude_values
+    )
+    return prompt
+
+
+STREAM_DEBOUNCE_SECONDS = 1 / 30  # Partial outputs are yielded at most ~30 times a second
+BATCH_MAX_PROMPTS = 4  # Requests packed into one model call by run_batch; bigger batches answer slower
+
+
+def _batch_chunks(prompts: list[str]) -> list[list[str]]:
+    """Split prompts into groups of at most BATCH_MAX_PROMPTS"""
+    return [prompts[start:start + BATCH_MAX_PROMPTS] for start in range(0, len(prompts), BATCH_MAX_PROMPTS)]
+
+
+def _compose_batch_user_prompt(prompts: list[str]) -> str:
+    """Number several requests into one user message for CreateQueryAgent.run_batch"""
+    numbered = "\n".join(f"{i}) {prompt}" for i, prompt in enumerate(prompts, start=1))
+    return (
+        "Handle each numbered request below independently. Return a list with exactly "
+        "one output per request, in the same order: a CreateQueryOutput when a query "
+        "can be built, otherwise a CreateQueryError.\n\n" + numbered
+    )
+
+
+def _check_batch_output(
+    prompts: list[str],
+    output: list[CreateQueryOutput | CreateQueryError]
+) -> list[CreateQueryOutput | CreateQueryError]:
+    """Ensure a batched response has exactly one output per request"""
+    if len(output) != len(prompts):
+        raise ValueError(f"Expected {len(prompts)} outputs for batched requests, got {len(output)}")
+    return output
+
+
+class CreateQueryAgent:
+    def __init__(self, target_type: str, metadata: FHIRMetadata, common_search_params: list[SearchParameter]) -> None:
+        self.target_type = target_type
+        self.metadata = metadata
+        self.common_search_params = common_search_params
+
+        # Names the generated query may use, for O(1) checks in validate()
+        self._param_name_set: frozenset[str] = frozenset(
+            p.name for p in _available_search_params(target_type, metadata, common_search_params)
+        )
+
+        # pydantic_ai is imported lazily so metadata-only callers don't pay for it
+        from pydantic_ai import Agent
+        from pydantic_ai.models.anthropic import AnthropicModel, AnthropicModelSettings
+
+        self.model = AnthropicModel('claude-opus-4-5')
+        self.agent = Agent(
+            model=self.model,
+            output_type=CreateQueryOutput | CreateQueryError,
+            system_prompt=self._build_system_prompt(),
+            model_settings=AnthropicModelSettings(anthropic_cache_instructions=PROMPT_CACHE_TTL)
+        )
+
+    def _build_system_prompt(self) -> str:
+        """Build dynamic system prompt with available search params from metadata"""
+        return _create_query_system_prompt(self.target_type, self.metadata, self.common_search_params)
+
+    def validate(self, query_string: str) -> list[str]:
+        """
+        Find search parameters in a query string that are not available for the target type.
+
+        Modifiers (name:exact), chains (patient.name) and reverse chains
+        (_has:Observation:patient:code) are checked by their base parameter name.
+        A leading "?" or "ResourceType?" prefix is ignored and names are URL-decoded.
+
+        Args:
+            query_string: Query string as produced in CreateQueryOutput.query_string
+
+        Returns:
+            Unknown parameter names in order of first appearance (empty if all are valid)
+        """
+        unknown: list[str] = []
+        if '?' in query_string:
+            query_string = query_string.partition('?')[2]
+        for key, _ in parse_qsl(query_string, keep_blank_values=True):
+            name = re.split(r'[:.]', key, maxsplit=1)[0]
+            if name and name not in self._param_name_set and name not in unknown:
+                unknown.append(name)
+        return unknown
+
+    def run_batch(self, prompts: list[str]) -> list[CreateQueryOutput | CreateQueryError]:
+        """
+        Build queries for several requests, sharing the system prompt and round trip.
+
+        Requests are sent BATCH_MAX_PROMPTS at a time as one numbered user message.
+
+        Args:
+            prompts: Natural language queries
+
+        Returns:
+            One output per prompt, in the same order
+
+        Raises:
+            ValueError: If the model returns a different number of outputs than requests
+        """
+        outputs: list[CreateQueryOutput | CreateQueryError] = []
+        for chunk in _batch_chunks(prompts):
+            result = self.agent.run_sync(
+                _compose_batch_user_prompt(chunk),
+                output_type=list[CreateQueryOutput | CreateQueryError]
+            )
+            outputs.extend(_check_batch_output(chunk, result.output))
+        return outputs
+
+    async def run_batch_async(self, prompts: list[str]) -> list[CreateQueryOutput | CreateQueryError]:
+        """
+        Async version of run_batch that sends all groups of requests concurrently.
+
+        Args:
+            prompts: Natural language queries
+
+        Returns:
+            One output per prompt, in the same order
+
+        Raises:
+            ValueError: If the model returns a different number of outputs than requests
+        """
+        chunks = _batch_chunks(prompts)
+        results = await asyncio.gather(*(
+            self.agent.run(
+                _compose_batch_user_prompt(chunk),
+                output_type=list[CreateQueryOutput | CreateQueryError]
+            )
+            for chunk in chunks
+        ))
+        return [
+            output
+            for chunk, result in zip(chunks, results)
+            for output in _check_batch_output(chunk, result.output)
+        ]
+
+    def run_via_batch_api(self, prompts: list[str]) -> list[CreateQueryOutput | CreateQueryError]:
+        """
+        Build queries for several requests through the Message Batches API.
+
+        Cheaper than run_batch but may take minutes; meant for non-interactive runs.
+
+        Args:
+            prompts: Natural language queries
+
+        Returns:
+            One output per prompt, in the same order
+        """
+        return run_message_batch(
+            self.model.model_name, self._build_system_prompt(), prompts,
+            CreateQueryOutput | CreateQueryError
+        )
+
+    async def stream_query(
+        self,
+        query: str,
+        debounce_by: float | None = STREAM_DEBOUNCE_SECONDS
+    ) -> AsyncIterator[CreateQueryOutput | CreateQueryError]:
+        """
+        Build a query, yielding partial outputs while the model streams its answer.
+
+        Partial outputs are validated leniently and may have incomplete fields;
+        the last item yielded is the fully validated final output.
+
+        Args:
+            query: Natural language query
+            debounce_by: Seconds to group streamed chunks by (None for every chunk)
+
+        Yields:
+            Partial outputs, then the final CreateQueryOutput or CreateQueryError
+        """
+        async with self.agent.run_stream(query) as result:
+            async for partial in result.stream_output(debounce_by=debounce_by):
+                yield partial
+            yield await result.get_output()
+
+
+# ============================================================================
+# Startup Helpers
+# ============================================================================
+
+# Resource types whose CreateQueryAgent prompts are built ahead of time
+WARM_TARGET_TYPES = ("Patient", "Observation", "Condition", "MedicationRequest", "Encounter")
+
+
+def _warm_agents(metadata: FHIRMetadata) -> SelectTypesAgent:
+    """Create the SelectTypesAgent and prime CreateQueryAgent prompts for common types"""
+    select_agent = SelectTypesAgent(metadata)
+    for target_type in WARM_TARGET_TYPES:
+        if target_type in metadata.resource_metadata:
+            _create_query_system_prompt(target_type, metadata, COMMON_SEARCH_PARAMS)
+    return select_agent
+
+
+async def init_metadata_and_warm(
+    base_url: str = DEFAULT_FHIR_SERVER,
+    username: str | None = None,
+    password: str | None = None,
+    refresh: bool = False,
+    executor: Executor | None = None
+) -> tuple[FHIRMetadata, SelectTypesAgent]:
+    """
+    Fetch server metadata and prepare the agents that depend on it.
+
+    The pydantic_ai import (deferred by the agent constructors) runs while the
+    metadata request is in flight. Once metadata arrives, the SelectTypesAgent
+    is built and CreateQueryAgent prompts for WARM_TARGET_TYPES are primed, off
+    the event loop.
+
+    Args:
+        base_url: FHIR server base URL (default: SMART Health IT R4 server)
+        username: Optional username for basic authentication
+        password: Optional password for basic authentication
+        refresh: Revalidate with the server even if the cached metadata is fresh
+        executor: Executor for the blocking steps; None uses the event loop's default
+
+    Returns:
+        Tuple of (FHIRMetadata, SelectTypesAgent)
+    """
+    loop = asyncio.get_running_loop()
+    metadata_future = loop.run_in_executor(
+        executor, fetch_searchable_resources, base_url, username, password, None, refresh
+    )
+    await loop.run_in_executor(executor, importlib.import_module, 'pydantic_ai.models.anthropic')
+    metadata = await metadata_future
+    select_agent = await loop.run_in_executor(executor, _warm_agents, metadata)
+    return metadata, select_agent
@@ -0,0 +1,962 @@
+"""
+FHIR Query Builder TUI (Text User Interface)
+
+A terminal-based interface for building FHIR search queries using AI agents.
+
+The agents module (and with it requests/pydantic), dotenv and pyperclip are
+imported on first use rather than at module import, so the login screen
+appears without waiting for them.
+"""
+
+from __future__ import annotations
+
+from rich.text import Text
+from textual.app import App, ComposeResult
+from textual.containers import Center, Middle, Horizontal, Vertical, ScrollableContainer
+from textual.widgets import (
+    Header,
+    Footer,
+    Input,
+    Button,
+    Static,
+    Label,
+    Select,
+    TextArea,
+    LoadingIndicator,
+)
+from textual.binding import Binding
+from textual import on, work
+from textual.screen import Screen
+from textual.worker import Worker, WorkerState
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from enum import IntEnum
+from typing import TYPE_CHECKING, Any, Literal, TypeVar
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+
+if TYPE_CHECKING:
+    from .agents import (
+        SelectTypesAgent,
+        CreateQueryAgent,
+        SelectedResourceType,
+        CreateQueryOutput,
+        CreateQueryError,
+        FHIRMetadata,
+    )
+
+T = TypeVar("T")
+
+
+def _hash_password(password: str) -> bytes:
+    """Fixed-length digest so comparisons don't depend on password length"""
+    return hashlib.sha256(password.encode()).digest()
+
+
+@cache
+def tui_password_hash() -> bytes | None:
+    """
+    Load environment variables and hash TUI_PASSWORD, once, on the first login attempt.
+
+    Returns:
+        Digest of the configured password, or None (rejects every login) if unset
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    password = os.getenv("TUI_PASSWORD")
+    return _hash_password(password) if password else None
+
+
+def _short_err(error: BaseException, limit: int = 100) -> str:
+    """
+    One-line description of an error for status messages, at most limit characters.
+
+    HTTP errors are described by status code and URL, and string messages are
+    sliced directly, so a large payload attached to an exception (e.g. a
+    response body) is never stringified in full.
+    """
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None)
+    if status_code is not None:
+        return f"HTTP {status_code} from {getattr(response, 'url', '?')}"[:limit]
+    message = error.args[0] if error.args else None
+    if isinstance(message, str):
+        return message[:limit]
+    return str(error)[:limit] or type(error).__name__
+
+
+def _copy_to_clipboard(text: str) -> None:
+    """
+    Copy text with pyperclip, imported on first use since it is optional.
+
+    Raises:
+        ImportError: If pyperclip is not installed
+        RuntimeError: If no clipboard mechanism is available (PyperclipException)
+    """
+    import pyperclip
+    pyperclip.copy(text)
+
+
+def _new_io_pool() -> ThreadPoolExecutor:
+    """Bounded thread pool for blocking TUI work (metadata fetches, agent setup, clipboard)"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="fhir-io")
+
+
+# ============================================================================
+# Select Types Result Cache
+# ============================================================================
+
+SELECT_CACHE_FILENAME = "select_cache.json"  # Stored next to the metadata cache
+SELECT_CACHE_SIZE = 64  # Max remembered (server URL, query) pairs
+
+SelectCache = OrderedDict[tuple[str, str], list["SelectedResourceType"]]
+
+BUILD_CACHE_SIZE = 64  # Max remembered (target type, query) builds for the connected server
+
+
+def _select_cache_key(server_url: str, query: str) -> tuple[str, str]:
+    """Normalize a query so trivially different spellings share an entry"""
+    return server_url, query.strip().lower()
+
+
+def load_select_cache() -> SelectCache:
+    """Load persisted type selections, oldest first; empty if missing or unreadable"""
+    from .agents import SelectedResourceType
+    from .metadata_cache import CACHE_DIR
+
+    select_cache: SelectCache = OrderedDict()
+    try:
+        entries = json.loads((CACHE_DIR / SELECT_CACHE_FILENAME).read_text())
+        for entry in entries[-SELECT_CACHE_SIZE:]:
+            select_cache[(entry["server_url"], entry["query"])] = [
+                SelectedResourceType.model_validate(result) for result in entry["results"]
+            ]
+    except (OSError, ValueError, KeyError, TypeError):
+        return OrderedDict()
+    return select_cache
+
+
+def save_select_cache(cache: SelectCache) -> None:
+    """Persist type selections for reuse in later sessions; failures are ignored"""
+    entries = [
+        {"server_url": server_url, "query": query, "results": [r.model_dump() for r in results]}
+        for (server_url, query), results in cache.items()
+    ]
+    from .metadata_cache import CACHE_DIR, write_atomic
+
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        write_atomic(CACHE_DIR / SELECT_CACHE_FILENAME, json.dumps(entries))
+    except OSError:
+        pass
+
+
+class UIState(IntEnum):
+    """Progress through the builder steps; each step enables the controls of the next"""
+    INITIAL = 0  # Nothing to do but connect
+    CONNECTED = 1  # Metadata loaded: types can be selected
+    TYPES_SELECTED = 2  # Types listed: a query can be built
+    QUERY_BUILT = 3  # Query shown: it can be copied
+
+
+StatusKind = Literal["loading", "success", "error", "clear"]
+
+
+class StatusMessage(Static):
+    """A status message widget that can show different states"""
+
+    ICONS: dict[StatusKind, str] = {"loading": "⏳ ", "success": "✓ ", "error": "✗ ", "clear": ""}
+    STATE_CLASSES = frozenset({"loading", "success", "error"})
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._state: tuple[StatusKind, str] = ("clear", "")
+
+    def set_state(self, kind: StatusKind, message: str = "") -> None:
+        """Show a message in the given state with a single refresh; repeats are ignored"""
+        if (kind, message) == self._state:
+            return
+        self._state = (kind, message)
+        # Swap the state class in one assignment so styles are recomputed once
+        classes = self.classes - self.STATE_CLASSES
+        if kind in self.STATE_CLASSES:
+            classes |= {kind}
+        with self.app.batch_update():
+            self.update(f"{self.ICONS[kind]}{message}")
+            self.set_classes(classes)
+
+    def set_loading(self, message: str = "Loading..."):
+        """Show loading state"""
+        self.set_state("loading", message)
+
+    def set_success(self, message: str):
+        """Show success state"""
+        self.set_state("success", message)
+
+    def set_error(self, message: str):
+        """Show error state"""
+        self.set_state("error", message)
+
+    def clear(self):
+        """Clear the message"""
+        self.set_state("clear")
+
+
+class TypeOption(Static):
+    """A clickable resource type option"""
+
+    def __init__(self, index: int, selected_type: SelectedResourceType, **kwargs):
+        self.type_index = index
+        self.selected_type = selected_type
+        # Pre-styled Text skips markup parsing, so brackets in the reasoning render as-is
+        content = Text.assemble(
+            (f"[{index + 1}] ", "bold"),
+            (selected_type.selected_type, "bold"),
+            (f" (confidence: {selected_type.confidence:.2f})\n", "dim"),
+            f"    {selected_type.reasoning}",
+        )
+        super().__init__(content, **kwargs)
+
+    def on_click(self) -> None:
+        """Handle click to select this type"""
+        # FIX: Use self.screen instead of self.app.
+        # The logic resides on the FHIRQueryBuilderApp Screen, not the main FhirApp.
+        if isinstance(self.screen, FHIRQueryBuilderApp):
+            self.screen.select_type_at_index(self.type_index)
+
+class FhirApp(App):
+    CSS_PATH = "fhir_tui.tcss"
+
+    def on_mount(self):
+        self.push_screen(LoginScreen())
+
+class LoginScreen(Screen):
+    def compose(self) -> ComposeResult:
+        yield Middle(
+            Center(
+                Label("🔒 Restricted Access"),
+                Input(placeholder="Password", password=True, id="password"),
+                Button("Login", id="login_btn"),
+            )
+        )
+
+    @on(Button.Pressed, "#login_btn")
+    def check_password(self):
+        password_input = self.query_one("#password", Input)
+        password_hash = tui_password_hash()
+        if password_hash is not None and hmac.compare_digest(
+            _hash_password(password_input.value), password_hash
+        ):
+            from .agents import DEFAULT_FHIR_SERVER, init_metadata_and_warm
+
+            # Fetch metadata for the default server while the user fills in the form,
+            # on the I/O pool the builder screen takes over
+            io_pool = _new_io_pool()
+            prefetch = self.app.run_worker(
+                init_metadata_and_warm(DEFAULT_FHIR_SERVER, None, None, executor=io_pool),
+                name="metadata-prefetch",
+                exit_on_error=False
+            )
+            self.app.push_screen(FHIRQueryBuilderApp(
+                metadata_prefetch=(DEFAULT_FHIR_SERVER, prefetch),
+                io_pool=io_pool
+            ))
+        else:
+            self.notify("Incorrect Password", severity="error")
+
+class FHIRQueryBuilderApp(Screen):
+    """
+    FHIR Query Builder TUI Application
+
+    Inputs only react to Input.Submitted (Enter). Do not add Input.Changed
+    handlers: they run on every keystroke and would make typing lag.
+    """
+
+    BINDINGS = [
+        Binding("q", "quit", "Quit", show=True),
+        Binding("r", "reset", "Reset", show=True),
+        # Type selection from the keyboard; digits only fire when no Input consumes them
+        *(Binding(str(n), f"select_type({n - 1})", show=False) for n in range(1, 10)),
+        # Arrows need priority over #main-container's scroll bindings; check_action
+        # hands them back when an Input or scroll container has focus
+        Binding("up", "select_prev", "Prev Type", show=False, priority=True),
+        Binding("down", "select_next", "Next Type", show=False, priority=True),
+        # Not Enter: the focused query Input consumes it to reselect types
+        Binding("ctrl+b", "build", "Build Query", show=True),
+    ]
+
+    TYPE_SELECTION_ACTIONS = frozenset({"select_type", "select_prev", "select_next", "build"})
+    ARROW_KEY_ACTIONS = frozenset({"select_prev", "select_next"})
+
+    # Top selections at least this confident get their query built before Build is clicked
+    SPECULATIVE_BUILD_CONFIDENCE = 0.8
+
+    TITLE = "FHIR Query Builder"
+    SUB_TITLE = "AI-Powered FHIR Search Query Generator"
+
+    def __init__(
+        self,
+        metadata_prefetch: tuple[str, Worker[tuple[FHIRMetadata, SelectTypesAgent]]] | None = None,
+        io_pool: ThreadPoolExecutor | None = None
+    ):
+        """
+        Args:
+            metadata_prefetch: Optional (server URL, worker) pair already fetching
+                metadata for that server, used by the first matching connect
+            io_pool: Pool for blocking work, e.g. the one running metadata_prefetch;
+                the screen shuts it down on unmount
+        """
+        super().__init__()
+        self.metadata: FHIRMetadata | None = None
+        self.select_agent: SelectTypesAgent | None = None
+        self.selected_types: list[SelectedResourceType] = []
+        self.selected_type_index: int = 0
+        self._type_widgets: list[TypeOption] = []  # Mounted options, indexed like selected_types
+        self._query_agents: dict[str, CreateQueryAgent] = {}  # Per-type agents for the current metadata
+        # ((target type, query), worker) for a build started ahead of the Build click
+        self._speculative_build: tuple[tuple[str, str], Worker[CreateQueryOutput | CreateQueryError]] | None = None
+        self._io_pool = io_pool or _new_io_pool()  # Shared by all workers
+        self.last_query_url: str = ""  # Store the last generated URL
+        self._pending_query: str = ""  # Store query for worker
+        self._pending_server_url: str = ""  # Store server URL for worker
+        self._pending_username: str | None = None  # Store username for worker
+        self._pending_password: str | None = None  # Store password for worker
+        self._pending_refresh: bool = False  # Reconnect to the connected server revalidates its metadata
+        self._ui_state = UIState.INITIAL
+        self._metadata_prefetch = metadata_prefetch
+        self._pending_prefetch: Worker[tuple[FHIRMetadata, SelectTypesAgent]] | None = None
+        self._select_cache: SelectCache = load_select_cache()
+        # Successful builds by (target type, query); cleared when metadata changes
+        self._build_cache: OrderedDict[tuple[str, str], CreateQueryOutput] = OrderedDict()
+
+    def action_quit(self) -> None:
+        self.app.exit()
+
+    async def _run_blocking(self, func: Callable[..., T], *args: Any) -> T:
+        """Run a blocking call on the shared I/O thread pool without blocking the UI"""
+        return await asyncio.get_running_loop().run_in_executor(self._io_pool, func, *args)
+
+    def check_action(self, action: str, parameters: tuple[object, ...]) -> bool | None:
+        """Only claim selection keys while there are types to choose from"""
+        if action in self.TYPE_SELECTION_ACTIONS and not self.selected_types:
+            return False
+        if action in self.ARROW_KEY_ACTIONS and isinstance(self.focused, (Input, ScrollableContainer)):
+            return False
+        return True
+
+    def action_select_type(self, index: int) -> None:
+        """Select the type at a 0-based index (bound to digit keys)"""
+        self.select_type_at_index(index)
+
+    def action_select_prev(self) -> None:
+        """Move the selection up one type"""
+        self.select_type_at_index(max(0, self.selected_type_index - 1))
+
+    def action_select_next(self) -> None:
+        """Move the selection down one type"""
+        self.select_type_at_index(min(len(self.selected_types) - 1, self.selected_type_index + 1))
+
+    async def action_build(self) -> None:
+        """Build a query for the selected type"""
+        if not self._w_build_btn.disabled:
+            await self.build_query()
+
+    def compose(self) -> ComposeResult:
+        """Create child widgets for the app."""
+        from .agents import DEFAULT_FHIR_SERVER
+
+        yield Header()
+
+        with ScrollableContainer(id="main-container"):
+            # Step 1: Server Configuration
+            with Vertical(classes="section"):
+                yield Label("Step 1: FHIR Server Configuration", classes="section-title")
+                yield Label("Enter FHIR server base URL:")
+                yield Input(
+                    placeholder=DEFAULT_FHIR_SERVER,
+                    value=DEFAULT_FHIR_SERVER,
+                    id="server-url",
+                )
+                yield Label("Optional: Basic Authentication (leave empty if not needed)")
+                with Horizontal():
+                    yield Input(
+                        placeholder="Username (optional)",
+                        id="auth-username",
+                    )
+                    yield Input(
+                        placeholder="Password (optional)",
+                        password=True,
+                        id="auth-password",
+                    )
+                yield Button("Connect to Server", id="connect-btn", variant="primary")
+                yield StatusMessage(id="server-status")
+
+            # Step 2: Query Input
+            with Vertical(classes="section"):
+                yield Label("Step 2: Enter Your Query", classes="section-title")
+                yield Label("Describe what you want to search for:")
+                yield Input(
+                    placeholder="e.g., Find all female patients born after 1990",
+                    id="query-input",
+                )
+                yield Button("Select Resource Types", id="select-types-btn", variant="primary")
+                yield StatusMessage(id="select-status")
+
+            # Step 3: Type Selection
+            with Vertical(classes="section"):
+                yield Label("Step 3: Select Resource Type", classes="section-title")
+                yield Label("Click on a resource type to select it:", id="selection-hint")
+                yield ScrollableContainer(id="selected-types")
+                yield Button("Build Query", id="build-query-btn", variant="primary")
+                yield StatusMessage(id="build-status")
+
+            # Step 4: Query Output
+            with Vertical(classes="section"):
+                yield Label("Step 4: Generated FHIR Query", classes="section-title")
+                yield Static(id="query-output")
+                yield Button("Copy to Clipboard", id="copy-btn", variant="default")
+
+        yield Footer()
+
+    async def on_mount(self) -> None:
+        """Handle app mount - cache widget references and disable buttons until server is connected"""
+        # Handlers use these instead of repeating query_one selector lookups
+        self._w_query_input = self.query_one("#query-input", Input)
+        self._w_types_container = self.query_one("#selected-types", ScrollableContainer)
+        self._w_query_output = self.query_one("#query-output", Static)
+        self._w_server_status = self.query_one("#server-status", StatusMessage)
+        self._w_select_status = self.query_one("#select-status", StatusMessage)
+        self._w_build_status = self.query_one("#build-status", StatusMessage)
+        self._w_selection_hint = self.query_one("#selection-hint", Label)
+        self._w_select_btn = self.query_one("#select-types-btn", Button)
+        self._w_build_btn = self.query_one("#build-query-btn", Button)
+        self._w_copy_btn = self.query_one("#copy-btn", Button)
+        self._w_server_url = self.query_one("#server-url", Input)
+        self._w_auth_username = self.query_one("#auth-username", Input)
+        self._w_auth_password = self.query_one("#auth-password", Input)
+        self._w_connect_btn = self.query_one("#connect-btn", Button)
+
+        self._set_ui_state(UIState.INITIAL)
+
+    def _set_ui_state(self, state: UIState) -> None:
+        """
+        Enable the controls for a step in one refresh.
+
+        Controls disabled while a request is in flight are re-enabled here too,
+        so handlers call this again with the current state when a request fails.
+        """
+        self._ui_state = state
+        with self.app.batch_update():
+            self._w_select_btn.disabled = state < UIState.CONNECTED
+            self._w_build_btn.disabled = state < UIState.TYPES_SELECTED
+            self._w_copy_btn.disabled = state < UIState.QUERY_BUILT
+            self._w_selection_hint.display = state >= UIState.TYPES_SELECTED
+
+    def select_type_at_index(self, index: int) -> None:
+        """Select a resource type at the given index"""
+        if not 0 <= index < len(self.selected_types):
+            return
+
+        # Update the selected index
+        old_index = self.selected_type_index
+        self.selected_type_index = index
+
+        # Update visual selection
+        if old_index < len(self._type_widgets):
+            self._type_widgets[old_index].remove_class("selected")
+        if index < len(self._type_widgets):
+            self._type_widgets[index].add_class("selected")
+
+        # Update build status to show which type is selected
+        status = self._w_build_status
+        selected = self.selected_types[index]
+        status.set_success(f"Selected: {selected.selected_type}")
+
+    @on(Input.Submitted, "#server-url")
+    async def _on_server_url_submitted(self) -> None:
+        """Enter in the server URL field connects, like the Connect button"""
+        if not self._w_connect_btn.disabled:
+            await self.connect_to_server()
+
+    @on(Input.Submitted, "#query-input")
+    async def _on_query_submitted(self) -> None:
+        """Enter in the query field selects types, like the Select button"""
+        if not self._w_select_btn.disabled:
+            await self.select_resource_types()
+
+    @on(Button.Pressed, "#connect-btn")
+    async def connect_to_server(self) -> None:
+        """Connect to FHIR server and fetch metadata"""
+        url_input = self._w_server_url
+        username_input = self._w_auth_username
+        password_input = self._w_auth_password
+        status = self._w_server_status
+
+        server_url = url_input.value.strip()
+        username = username_input.value.strip() or None
+        password = password_input.value.strip() or None
+
+        if not server_url:
+            status.set_error("Please enter a server URL")
+            return
+
+        # Metadata prefetched at login is only used once, for an unauthenticated connect
+        prefetch = None
+        if self._metadata_prefetch is not None:
+            prefetch_url, prefetch_worker = self._metadata_prefetch
+            self._metadata_prefetch = None
+            if prefetch_url == server_url and username is None and password is None:
+                prefetch = prefetch_worker
+        if (
+            prefetch is not None
+            and prefetch.state == WorkerState.SUCCESS
+            and prefetch.result is not None
+        ):
+            self._handle_connect_success(*prefetch.result)
+            return
+
+        status.set_loading("Connecting to FHIR server...")
+        self._w_connect_btn.disabled = True
+
+        # Store credentials for worker
+        self._pending_server_url = server_url
+        self._pending_username = username
+        self._pending_password = password
+        self._pending_refresh = self.metadata is not None and self.metadata.server_url == server_url
+        self._pending_prefetch = prefetch
+        self._run_connect_worker()
+
+    @work()
+    async def _run_connect_worker(self) -> None:
+        """Worker that fetches metadata and warms the agents off the event loop"""
+        from .agents import SelectTypesAgent, init_metadata_and_warm, load_cached_metadata
+
+        server_url = self._pending_server_url
+        preview: tuple[FHIRMetadata, SelectTypesAgent] | None = None
+
+        # Use the login prefetch (finished or still running) rather than starting a second fetch
+        prefetch, self._pending_prefetch = self._pending_prefetch, None
+        if prefetch is not None:
+            try:
+                metadata, select_agent = await prefetch.wait()
+            except Exception:
+                pass  # Fall back to a regular connect
+            else:
+                self._handle_connect_success(metadata, select_agent)
+                return
+
+        # Show stale cached metadata right away, then revalidate it against the server.
+        # A fresh entry is skipped here: the fetch below returns it without network access.
+        if not self._pending_refresh:
+            cached = await self._run_blocking(load_cached_metadata, server_url, True)
+            if cached is not None:
+                preview = (cached, await self._run_blocking(SelectTypesAgent, cached))
+        if preview is not None:
+            self._handle_connect_success(*preview, from_cache=True)
+
+        try:
+            metadata, select_agent = await init_metadata_and_warm(
+                server_url,
+                self._pending_username,
+                self._pending_password,
+                refresh=self._pending_refresh,
+                executor=self._io_pool
+            )
+        except Exception as e:
+            if preview is None:
+                self._handle_connect_error(e)
+            else:
+                self._w_server_status.set_error(
+                    f"Using cached metadata, refresh failed: {_short_err(e, 80)}"
+                )
+                self._w_connect_btn.disabled = False
+            return
+        self._handle_connect_success(metadata, select_agent)
+
+    def _handle_connect_success(
+        self,
+        metadata: FHIRMetadata,
+        select_agent: SelectTypesAgent,
+        from_cache: bool = False
+    ) -> None:
+        """Handle successful connection"""
+        status = self._w_server_status
+        if metadata.same_content(self.metadata):
+            # Revalidation found no change: keep the current objects and their warm agents
+            metadata, select_agent = self.metadata, self.select_agent
+        else:
+            self._query_agents = {}
+            self._build_cache.clear()
+            self._cancel_speculative_build()
+        self.metadata = metadata
+        self.select_agent = select_agent
+        if from_cache:
+            # Connect button stays disabled until revalidation finishes
+            status.set_loading(
+                f"Loaded {len(self.metadata.searchable_types)} cached resource types, checking for updates..."
+            )
+        else:
+            status.set_success(
+                f"Connected! Found {len(self.metadata.searchable_types)} resource types"
+            )
+            self._w_connect_btn.disabled = False
+        self._set_ui_state(max(self._ui_state, UIState.CONNECTED))
+
+    def _handle_connect_error(self, error: Exception) -> None:
+        """Handle connection error"""
+        status = self._w_server_status
+        status.set_error(f"Connection failed: {_short_err(error)}")
+        self._w_connect_btn.disabled = False
+
+    @on(Button.Pressed, "#select-types-btn")
+    async def select_resource_types(self) -> None:
+        """Use AI to select appropriate resource types"""
+        query_input = self._w_query_input
+        status = self._w_select_status
+
+        query = query_input.value.strip()
+        if not query:
+            status.set_error("Please enter a query")
+            return
+
+        if not self.select_agent:
+            status.set_error("Please connect to a server first")
+            return
+
+        status.set_loading("Analyzing query and selecting types...")
+        
+        # Disable button while processing
+        self._w_select_btn.disabled = True
+
+        # Store query for use in worker
+        self._pending_query = query
+        self._run_select_types_worker()
+
+    @work()
+    async def _run_select_types_worker(self) -> None:
+        """Worker that runs type selection on the app's event loop"""
+        from .agents import SelectTypeError
+
+        key = _select_cache_key(self.metadata.server_url, self._pending_query)
+        cached = self._select_cache.get(key)
+        if cached is not None:
+            self._select_cache.move_to_end(key)
+            await self._handle_select_types_result(cached)
+            return
+
+        try:
+            results = await self.select_agent.select_types_async(self._pending_query)
+        except Exception as e:
+            self._handle_select_types_error(e)
+            return
+
+        # Failures are not cached so the next attempt asks the model again
+        if not isinstance(results, SelectTypeError):
+            self._select_cache[key] = results
+            if len(self._select_cache) > SELECT_CACHE_SIZE:
+                self._select_cache.popitem(last=False)
+        await self._handle_select_types_result(results)
+
+    async def _handle_select_types_result(self, results) -> None:
+        """Handle results from type selection worker"""
+        from .agents import SelectTypeError
+
+        status = self._w_select_status
+        types_container = self._w_types_container
+
+        # Clear previous results; wait for removal so widget IDs can be reused
+        self._type_widgets = []
+        await types_container.remove_children()
+
+        if isinstance(results, SelectTypeError):
+            status.set_error(f"Error: {results.error}")
+            types_container.mount(
+                Static(f"Reasoning: {results.reasoning}", classes="error")
+            )
+            self.selected_types = []
+            self._set_ui_state(UIState.CONNECTED)
+            return
+
+        # Display selected types
+        self.selected_types = results
+        self.selected_type_index = 0
+
+        widgets = [
+            TypeOption(
+                index=i,
+                selected_type=selected_type,
+                classes="type-option selected" if i == 0 else "type-option",
+                id=f"type-{i}",
+            )
+            for i, selected_type in enumerate(results)
+        ]
+
+        self._type_widgets = widgets
+
+        # Mount all options and update the surrounding UI in a single refresh
+        with self.app.batch_update():
+            types_container.mount(*widgets)
+
+            status.set_success(f"Found {len(results)} matching resource type(s)")
+
+            # Enable next step
+            self._set_ui_state(UIState.TYPES_SELECTED)
+
+            # Show which type is selected
+            build_status = self._w_build_status
+            build_status.set_success(f"Selected: {results[0].selected_type}")
+
+        # Leave the query Input so Enter builds instead of reselecting
+        self._w_build_btn.focus()
+
+        self._warm_query_agents([selected_type.selected_type for selected_type in results])
+
+        # The top type is usually accepted, so start building its query right away
+        self._cancel_speculative_build()
+        target_type, query = results[0].selected_type, self._pending_query
+        if (
+            results[0].confidence >= self.SPECULATIVE_BUILD_CONFIDENCE
+            and (target_type, query.strip()) not in self._build_cache
+        ):
+            self._speculative_build = ((target_type, query.strip()), self.run_worker(
+                self._build_query_output(target_type, query),
+                name="speculative-build",
+                exit_on_error=False
+            ))
+
+    def _cancel_speculative_build(self) -> None:
+        """Drop a speculative build that is no longer wanted"""
+        if self._speculative_build is not None:
+            self._speculative_build[1].cancel()
+            self._speculative_build = None
+
+    def _take_speculative_build(
+        self, target_type: str, query: str
+    ) -> Worker[CreateQueryOutput | CreateQueryError] | None:
+        """Return the speculative build for this type and query, cancelling any other"""
+        speculative, self._speculative_build = self._speculative_build, None
+        if speculative is None:
+            return None
+        key, worker = speculative
+        if key != (target_type, query.strip()):
+            worker.cancel()
+            return None
+        return worker
+
+    async def _build_query_output(self, target_type: str, query: str) -> CreateQueryOutput | CreateQueryError:
+        """Build a query without touching the UI (used for speculative builds)"""
+        query_agent = await self._run_blocking(self._get_query_agent, target_type)
+        result = await query_agent.agent.run(query)
+        self._remember_build(target_type, query, result.output)
+        return result.output
+
+    def _remember_build(
+        self, target_type: str, query: str, query_output: CreateQueryOutput | CreateQueryError
+    ) -> None:
+        """Cache a successful build; errors are not cached so the next attempt asks the model again"""
+        from .agents import CreateQueryOutput
+
+        if isinstance(query_output, CreateQueryOutput):
+            self._build_cache[(target_type, query.strip())] = query_output
+            if len(self._build_cache) > BUILD_CACHE_SIZE:
+                self._build_cache.popitem(last=False)
+
+    def _get_query_agent(self, target_type: str) -> CreateQueryAgent:
+        """Return the CreateQueryAgent for a type, creating it on first use"""
+        from .agents import COMMON_SEARCH_PARAMS, CreateQueryAgent
+
+        query_agent = self._query_agents.get(target_type)
+        if query_agent is None:
+            query_agent = self._query_agents.setdefault(target_type, CreateQueryAgent(
+                target_type=target_type,
+                metadata=self.metadata,
+                common_search_params=COMMON_SEARCH_PARAMS,
+            ))
+        return query_agent
+
+    @work()
+    async def _warm_query_agents(self, target_types: list[str]) -> None:
+        """Worker that creates query agents ahead of the first Build Query click"""
+        for target_type in target_types:
+            try:
+                await self._run_blocking(self._get_query_agent, target_type)
+            except ValueError:
+                pass  # Type missing from metadata; reported when building
+
+    def _handle_select_types_error(self, error: Exception) -> None:
+        """Handle error from type selection worker"""
+        status = self._w_select_status
+        status.set_error(f"Type selection failed: {_short_err(error)}")
+        self._set_ui_state(self._ui_state)
+
+    @on(Button.Pressed, "#build-query-btn")
+    async def build_query(self) -> None:
+        """Build FHIR query for selected resource type"""
+        query_input = self._w_query_input
+        status = self._w_build_status
+
+        if not self.selected_types:
+            status.set_error("Please select resource types first")
+            return
+
+        # Use the currently selected type
+        selected_type = self.selected_types[self.selected_type_index]
+
+        status.set_loading(f"Building query for {selected_type.selected_type}...")
+        
+        # Disable button while processing
+        self._w_build_btn.disabled = True
+        
+        # Store data for worker
+        self._pending_query = query_input.value
+        self._pending_selected_type = selected_type
+        self._run_build_query_worker()
+
+    @work()
+    async def _run_build_query_worker(self) -> None:
+        """Worker that builds the query, showing partial output as the model streams it"""
+        target_type = self._pending_selected_type.selected_type
+
+        key = (target_type, self._pending_query.strip())
+        cached = self._build_cache.get(key)
+        if cached is not None:
+            self._build_cache.move_to_end(key)
+            self._handle_build_query_result(cached)
+            return
+
+        # Reuse a speculative build for the same type and query when there is one
+        speculative = self._take_speculative_build(target_type, self._pending_query)
+        if speculative is not None:
+            try:
+                query_output = await speculative.wait()
+            except Exception:
+                pass  # Cancelled or failed; build normally
+            else:
+                self._handle_build_query_result(query_output)
+                return
+
+        try:
+            query_agent = await self._run_blocking(self._get_query_agent, target_type)
+            # Generate query; the last streamed item is the validated output
+            query_output = None
+            async for query_output in query_agent.stream_query(self._pending_query):
+                self._show_partial_query(query_output)
+            if query_output is None:
+                raise ValueError("Model returned no output")
+        except Exception as e:
+            self._handle_build_query_error(e)
+            return
+        self._remember_build(target_type, self._pending_query, query_output)
+        self._handle_build_query_result(query_output)
+
+    def _show_partial_query(self, partial_output: CreateQueryOutput | CreateQueryError) -> None:
+        """Show the query string generated so far"""
+        query_string = getattr(partial_output, "query_string", None)
+        if query_string:
+            self._w_query_output.update(Text.assemble(("Generating...\n\n", "dim"), query_string))
+
+    def _handle_build_query_result(self, query_output) -> None:
+        """Handle results from query building worker"""
+        from .agents import CreateQueryError
+
+        status = self._w_build_status
+        output = self._w_query_output
+        selected_type = self._pending_selected_type
+
+        if isinstance(query_output, CreateQueryError):
+            status.set_error("Query generation failed")
+            output.update(
+                f"[bold red]Error:[/bold red] {query_output.error}\n\n"
+                f"[yellow]Suggestion:[/yellow] {query_output.suggestion or 'N/A'}"
+            )
+            self._set_ui_state(self._ui_state)
+            return
+
+        # Display the query
+        full_url = f"{self.metadata.server_url}/{selected_type.selected_type}?{query_output.query_string}"
+
+        # Store the URL for copying
+        self.last_query_url = full_url
+
+        output.update(
+            f"[bold green]Success![/bold green]\n\n"
+            f"[bold]Resource Type:[/bold] {selected_type.selected_type}\n"
+            f"[bold]Query String:[/bold] {query_output.query_string}\n\n"
+            f"[bold]Full URL:[/bold]\n{full_url}"
+        )
+
+        status.set_success("Query generated successfully!")
+
+        # Enable copy button
+        self._set_ui_state(UIState.QUERY_BUILT)
+
+    def _handle_build_query_error(self, error: Exception) -> None:
+        """Handle error from query building worker"""
+        status = self._w_build_status
+        status.set_error(f"Query building failed: {_short_err(error)}")
+        self._set_ui_state(self._ui_state)
+
+    @on(Button.Pressed, "#copy-btn")
+    def copy_to_clipboard(self) -> None:
+        """Copy the generated query URL to clipboard"""
+        if not self.last_query_url:
+            self.notify("No query to copy", severity="warning")
+            return
+        self._run_copy_worker(self.last_query_url)
+
+    @work()
+    async def _run_copy_worker(self, text: str) -> None:
+        """Worker that copies off the event loop, since pyperclip may spawn a subprocess"""
+        try:
+            await self._run_blocking(_copy_to_clipboard, text)
+            self.notify("✓ Copied to clipboard!", severity="information")
+        except (ImportError, RuntimeError):
+            # If pyperclip not available or clipboard not supported, just show the URL
+            self.notify(
+                f"Clipboard not available",
+                severity="information",
+                timeout=10
+            )
+
+    def action_reset(self) -> None:
+        """Reset the application to initial state"""
+        self.selected_types = []
+        self.selected_type_index = 0
+        self._type_widgets = []
+        self.last_query_url = ""
+        self._cancel_speculative_build()
+
+        # Apply every widget change in a single refresh
+        with self.app.batch_update():
+            self._w_query_input.value = ""
+            self._w_types_container.remove_children()
+            self._w_query_output.update("")
+            self._w_server_status.clear()
+            self._w_select_status.clear()
+            self._w_build_status.clear()
+            self._set_ui_state(UIState.INITIAL)
+
+        save_select_cache(self._select_cache)
+
+    def on_unmount(self) -> None:
+        """Persist the select cache and release the I/O pool when the screen goes away (e.g. on exit)"""
+        save_select_cache(self._select_cache)
+        self._io_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    """Run the FHIR Query Builder TUI, on uvloop when it is installed"""
+    try:
+        import uvloop
+    except ImportError:
+        loop = None  # Textual's default asyncio loop
+    else:
+        loop = uvloop.new_event_loop()
+    app = FhirApp()
+    app.run(loop=loop)
+
@@ -0,0 +1,115 @@
+"""
+FHIR Metadata Disk Cache
+
+Stores serialized FHIRMetadata per FHIR server so the CapabilityStatement does
+not have to be downloaded and parsed on every connect:
+- <sha256(server_url)>.json: the serialized FHIRMetadata
+- <sha256(server_url)>.meta.json: HTTP validators (ETag, Last-Modified) and
+  freshness info used for conditional revalidation
+
+This module only deals in bytes and validators; parsing the metadata is left
+to the caller so it does not depend on the agents module.
+"""
+
+from pydantic import BaseModel
+from pathlib import Path
+import hashlib
+import os
+import time
+
+
+# ============================================================================
+# Configuration
+# ============================================================================
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "fhir-query-builder"
+DEFAULT_TTL = 24 * 60 * 60  # Seconds an entry is served without revalidation
+
+
+# ============================================================================
+# Cache Entry Models
+# ============================================================================
+
+class CacheInfo(BaseModel):
+    """Sidecar describing a cached metadata file"""
+    etag: str | None = None
+    last_modified: str | None = None
+    version: int = 0  # Format version of the cached metadata, checked by the caller
+    fetched_at: float = 0.0  # Unix timestamp of the last successful fetch or revalidation
+
+    def is_fresh(self, ttl: float = DEFAULT_TTL) -> bool:
+        """Whether the entry is young enough to use without revalidating"""
+        return time.time() - self.fetched_at < ttl
+
+
+# ============================================================================
+# Cache Functions
+# ============================================================================
+
+def _paths(server_url: str) -> tuple[Path, Path]:
+    """Metadata and sidecar file locations for a server"""
+    key = hashlib.sha256(server_url.encode()).hexdigest()
+    return CACHE_DIR / f"{key}.json", CACHE_DIR / f"{key}.meta.json"
+
+
+def write_atomic(path: Path, data: str | bytes) -> None:
+    """Write via a temp file and os.replace so readers never see a partial file"""
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        tmp_path.write_bytes(data.encode() if isinstance(data, str) else data)
+        os.replace(tmp_path, path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def load(server_url: str) -> tuple[bytes | None, CacheInfo | None]:
+    """
+    Load the cached metadata for a server.
+
+    Args:
+        server_url: FHIR server base URL
+
+    Returns:
+        Tuple of (serialized metadata, CacheInfo); (None, None) if there is no
+        usable entry
+    """
+    metadata_path, info_path = _paths(server_url)
+    try:
+        info = CacheInfo.model_validate_json(info_path.read_bytes())
+        return metadata_path.read_bytes(), info
+    except (OSError, ValueError):
+        return None, None
+
+
+def store(server_url: str, metadata_json: str | bytes, info: CacheInfo) -> None:
+    """
+    Persist metadata and its sidecar. Failures are ignored since the cache is optional.
+
+    Args:
+        server_url: FHIR server base URL
+        metadata_json: Serialized FHIRMetadata
+        info: Validators and freshness info for the entry
+    """
+    metadata_path, info_path = _paths(server_url)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        write_atomic(metadata_path, metadata_json)
+        write_atomic(info_path, info.model_dump_json())
+    except OSError:
+        pass
+
+
+def touch(server_url: str, info: CacheInfo) -> None:
+    """
+    Mark an entry as just revalidated (e.g. after a 304) without rewriting the metadata.
+
+    Args:
+        server_url: FHIR server base URL
+        info: Sidecar of the entry; its fetched_at is updated in place
+    """
+    info.fetched_at = time.time()
+    try:
+        write_atomic(_paths(server_url)[1], info.model_dump_json())
+    except OSError:
+        pass
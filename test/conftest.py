@@ -0,0 +1,67 @@
+"""
+Shared pytest fixtures for the FHIR AI Query Builder tests
+
+Fixtures are session-scoped so metadata is fetched and agents are built once
+per test process; with pytest-xdist (`pytest -n auto`) that is once per worker.
+"""
+
+import pytest
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+from fhir_qb.agents import (
+    fetch_searchable_resources,
+    SelectTypesAgent,
+    CreateQueryAgent,
+    COMMON_SEARCH_PARAMS,
+)
+
+
+# ============================================================================
+# Options
+# ============================================================================
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--llm-batch",
+        action="store_true",
+        help="Send batched prompts through the Message Batches API (half price, may take minutes)",
+    )
+
+
+# ============================================================================
+# Fixtures
+# ============================================================================
+
+@pytest.fixture(scope="session")
+def metadata():
+    """Fetch metadata once for all tests (served from the on-disk cache unless FHIR_QB_NO_CACHE is set)"""
+    return fetch_searchable_resources()
+
+
+@pytest.fixture(scope="session")
+def select_agent(metadata):
+    """Create SelectTypesAgent instance"""
+    return SelectTypesAgent(metadata)
+
+
+@pytest.fixture(scope="session")
+def patient_query_agent(metadata):
+    """Create CreateQueryAgent for Patient resource"""
+    return CreateQueryAgent(
+        target_type="Patient",
+        metadata=metadata,
+        common_search_params=COMMON_SEARCH_PARAMS
+    )
+
+
+@pytest.fixture(scope="session")
+def observation_query_agent(metadata):
+    """Create CreateQueryAgent for Observation resource"""
+    return CreateQueryAgent(
+        target_type="Observation",
+        metadata=metadata,
+        common_search_params=COMMON_SEARCH_PARAMS
+    )
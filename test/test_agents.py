@@ -6,17 +6,18 @@ This module contains comprehensive tests for the FHIR AI agents including:
 - Utility functions
 - SelectTypesAgent
 - CreateQueryAgent
+
+Shared fixtures (metadata, agents) live in conftest.py.
 """
 
-import pytest
-from dotenv import load_dotenv
+import asyncio
 
-# Load environment variables from .env file
-load_dotenv()
+import pytest
 
-from agents import (
-    fetch_searchable_resources,
+from fhir_qb.agents import (
     get_search_parameters,
+    merge_search_params,
+    SearchParameter,
     SelectTypesAgent,
     CreateQueryAgent,
     SelectedResourceType,
@@ -27,42 +28,6 @@ from agents import (
 )
 
 
-# ============================================================================
-# Fixtures
-# ============================================================================
-
-@pytest.fixture(scope="module")
-def metadata():
-    """Fetch metadata once for all tests"""
-    return fetch_searchable_resources()
-
-
-@pytest.fixture(scope="module")
-def select_agent(metadata):
-    """Create SelectTypesAgent instance"""
-    return SelectTypesAgent(metadata)
-
-
-@pytest.fixture(scope="module")
-def patient_query_agent(metadata):
-    """Create CreateQueryAgent for Patient resource"""
-    return CreateQueryAgent(
-        target_type="Patient",
-        metadata=metadata,
-        common_search_params=COMMON_SEARCH_PARAMS
-    )
-
-
-@pytest.fixture(scope="module")
-def observation_query_agent(metadata):
-    """Create CreateQueryAgent for Observation resource"""
-    return CreateQueryAgent(
-        target_type="Observation",
-        metadata=metadata,
-        common_search_params=COMMON_SEARCH_PARAMS
-    )
-
-
 # ============================================================================
 # Metadata Tests
 # ============================================================================
@@ -116,13 +81,48 @@ def test_get_search_parameters_invalid_type(metadata):
     assert "not found in metadata" in str(exc_info.value)
 
 
+def test_merge_search_params_prefers_resource_definition():
+    """Test that merged params are sorted and resource params override common ones"""
+    resource_params = [
+        SearchParameter(name="name", type="string"),
+        SearchParameter(name="_id", type="token", documentation="Server definition"),
+    ]
+    merged = merge_search_params(resource_params, COMMON_SEARCH_PARAMS)
+
+    names = [p.name for p in merged]
+    assert names == sorted(names)
+    assert names.count("_id") == 1
+    assert next(p for p in merged if p.name == "_id").documentation == "Server definition"
+    assert len(merged) == len(COMMON_SEARCH_PARAMS) + 1
+
+
 # ============================================================================
 # SelectTypesAgent Tests
 # ============================================================================
 
-def test_select_types_clear_query(select_agent):
+SELECT_QUERIES = [
+    "Find all patients born after 1990",
+    "Get medication data",
+    "Show me blood pressure readings",
+    "Find XYZ records",
+]
+
+
+@pytest.fixture(scope="session")
+def select_outputs(request, select_agent):
+    """Selections for SELECT_QUERIES, sent together instead of one call per test"""
+    if request.config.getoption("--llm-batch"):
+        outputs = select_agent.select_types_via_batch_api(SELECT_QUERIES)
+    else:
+        async def select_all():
+            return await asyncio.gather(*(select_agent.select_types_async(q) for q in SELECT_QUERIES))
+        outputs = asyncio.run(select_all())
+    return dict(zip(SELECT_QUERIES, outputs))
+
+
+def test_select_types_clear_query(select_outputs):
     """Test clear query: 'Find all patients born after 1990'"""
-    results = select_agent.select_types("Find all patients born after 1990")
+    results = select_outputs["Find all patients born after 1990"]
 
     # Should return a list of SelectedResourceType
     assert isinstance(results, list)
@@ -136,9 +136,9 @@ def test_select_types_clear_query(select_agent):
     assert len(first_result.reasoning) > 0
 
 
-def test_select_types_ambiguous_query(select_agent):
+def test_select_types_ambiguous_query(select_outputs):
     """Test ambiguous query: 'Get medication data'"""
-    results = select_agent.select_types("Get medication data")
+    results = select_outputs["Get medication data"]
 
     # Should return a list with multiple medication-related types
     assert isinstance(results, list)
@@ -153,9 +153,9 @@ def test_select_types_ambiguous_query(select_agent):
     assert any(t in medication_related for t in selected_types)
 
 
-def test_select_types_semantic_query(select_agent):
+def test_select_types_semantic_query(select_outputs):
     """Test semantic query: 'Show me blood pressure readings'"""
-    results = select_agent.select_types("Show me blood pressure readings")
+    results = select_outputs["Show me blood pressure readings"]
 
     # Should return appropriate type(s) for vital signs/observations
     assert isinstance(results, list) or isinstance(results, SelectTypeError)
@@ -167,9 +167,9 @@ def test_select_types_semantic_query(select_agent):
         assert any(t in ['Observation', 'DiagnosticReport'] for t in selected_types)
 
 
-def test_select_types_nonexistent_type(select_agent):
+def test_select_types_nonexistent_type(select_outputs):
     """Test non-existent type: 'Find XYZ records'"""
-    results = select_agent.select_types("Find XYZ records")
+    results = select_outputs["Find XYZ records"]
 
     # Should return SelectTypeError since XYZ doesn't exist
     assert isinstance(results, SelectTypeError)
@@ -181,105 +181,110 @@ def test_select_types_nonexistent_type(select_agent):
 # CreateQueryAgent Tests - Patient Resource
 # ============================================================================
 
-def test_create_query_simple_name(patient_query_agent):
-    """Test simple name search: 'Find patients with family name Smith'"""
-    result = patient_query_agent.agent.run_sync("Find patients with family name Smith")
-    output = result.output
-
-    assert isinstance(output, CreateQueryOutput)
-    assert 'family' in output.query_string.lower() or 'smith' in output.query_string.lower()
-    assert len(output.query_string) > 0
-
-
-def test_create_query_date_range(patient_query_agent):
-    """Test date range query: 'Patients born after January 1, 1990'"""
-    result = patient_query_agent.agent.run_sync("Patients born after January 1, 1990")
-    output = result.output
-
-    assert isinstance(output, CreateQueryOutput)
-    assert 'birthdate' in output.query_string.lower()
-    assert 'gt' in output.query_string or '>' in output.query_string or '1990' in output.query_string
-
-
-def test_create_query_multiple_params(patient_query_agent):
-    """Test multiple parameters: 'Find female patients named Maria born after 1985'"""
-    result = patient_query_agent.agent.run_sync("Find female patients named Maria born after 1985")
-    output = result.output
-
-    assert isinstance(output, CreateQueryOutput)
-    query = output.query_string.lower()
-
-    # Should contain multiple parameters
-    assert 'gender' in query or 'female' in query
-    assert 'name' in query or 'maria' in query
-    assert 'birthdate' in query or '1985' in query
-
-
-def test_create_query_token_syntax(patient_query_agent):
-    """Test token parameter: 'Find patient with MRN 12345 from system http://hospital.org/mrn'"""
-    result = patient_query_agent.agent.run_sync(
-        "Find patient with MRN 12345 from system http://hospital.org/mrn"
-    )
-    output = result.output
-
-    assert isinstance(output, CreateQueryOutput)
-    assert 'identifier' in output.query_string.lower()
-    assert '12345' in output.query_string
-
-
-def test_create_query_address(patient_query_agent):
-    """Test address search: 'Patients living in New York'"""
-    result = patient_query_agent.agent.run_sync("Patients living in New York")
-    output = result.output
-
-    assert isinstance(output, CreateQueryOutput)
-    assert 'address' in output.query_string.lower() or 'new' in output.query_string.lower()
-
-
-def test_create_query_result_control(patient_query_agent):
-    """Test result control: 'Get 10 most recent patients'"""
-    result = patient_query_agent.agent.run_sync("Get 10 most recent patients")
-    output = result.output
-
-    assert isinstance(output, CreateQueryOutput)
-    assert '_count' in output.query_string or 'count' in output.query_string
-    assert '_sort' in output.query_string or 'sort' in output.query_string or '10' in output.query_string
-
-
-def test_create_query_or_logic(patient_query_agent):
-    """Test OR logic: 'Find patients named John or Jane'"""
-    result = patient_query_agent.agent.run_sync("Find patients named John or Jane")
-    output = result.output
-
-    assert isinstance(output, CreateQueryOutput)
-    # Should use comma-separated values for OR logic
-    assert 'john' in output.query_string.lower() or 'jane' in output.query_string.lower()
-
-
-def test_create_query_error_handling(patient_query_agent):
-    """Test error handling: 'Find patients by their favorite color'"""
-    result = patient_query_agent.agent.run_sync("Find patients by their favorite color")
-    output = result.output
-
-    # Should return an error since favorite color is not a standard parameter
-    assert isinstance(output, CreateQueryError)
-    assert len(output.error) > 0
-
-
-def test_create_query_complex(patient_query_agent):
-    """Test complex query: 'Active female patients in California born between 1980-1990'"""
-    result = patient_query_agent.agent.run_sync(
-        "Active female patients in California born between 1980 and 1990"
-    )
-    output = result.output
-
-    assert isinstance(output, CreateQueryOutput)
-    query = output.query_string.lower()
-
-    # Should contain multiple conditions
-    assert 'gender' in query or 'female' in query
-    assert 'address' in query or 'california' in query
-    assert 'birthdate' in query or '1980' in query or '1990' in query
+# (prompt, expected output type, check on the output), one test item per case
+PATIENT_CASES = [
+    pytest.param(
+        "Find patients with family name Smith",
+        CreateQueryOutput,
+        lambda o: ('family' in o.query_string.lower() or 'smith' in o.query_string.lower())
+        and len(o.query_string) > 0,
+        id="simple_name",
+    ),
+    pytest.param(
+        "Patients born after January 1, 1990",
+        CreateQueryOutput,
+        lambda o: 'birthdate' in o.query_string.lower()
+        and ('gt' in o.query_string or '>' in o.query_string or '1990' in o.query_string),
+        id="date_range",
+    ),
+    pytest.param(
+        "Find female patients named Maria born after 1985",
+        CreateQueryOutput,
+        # Should contain multiple parameters
+        lambda o: ('gender' in o.query_string.lower() or 'female' in o.query_string.lower())
+        and ('name' in o.query_string.lower() or 'maria' in o.query_string.lower())
+        and ('birthdate' in o.query_string.lower() or '1985' in o.query_string.lower()),
+        id="multiple_params",
+    ),
+    pytest.param(
+        "Find patient with MRN 12345 from system http://hospital.org/mrn",
+        CreateQueryOutput,
+        lambda o: 'identifier' in o.query_string.lower() and '12345' in o.query_string,
+        id="token_syntax",
+    ),
+    pytest.param(
+        "Patients living in New York",
+        CreateQueryOutput,
+        lambda o: 'address' in o.query_string.lower() or 'new' in o.query_string.lower(),
+        id="address",
+    ),
+    pytest.param(
+        "Get 10 most recent patients",
+        CreateQueryOutput,
+        lambda o: ('_count' in o.query_string or 'count' in o.query_string)
+        and ('_sort' in o.query_string or 'sort' in o.query_string or '10' in o.query_string),
+        id="result_control",
+    ),
+    pytest.param(
+        "Find patients named John or Jane",
+        CreateQueryOutput,
+        # Should use comma-separated values for OR logic
+        lambda o: 'john' in o.query_string.lower() or 'jane' in o.query_string.lower(),
+        id="or_logic",
+    ),
+    pytest.param(
+        "Find patients by their favorite color",
+        # Should return an error since favorite color is not a standard parameter
+        CreateQueryError,
+        lambda o: len(o.error) > 0,
+        id="error_handling",
+    ),
+    pytest.param(
+        "Active female patients in California born between 1980 and 1990",
+        CreateQueryOutput,
+        # Should contain multiple conditions
+        lambda o: ('gender' in o.query_string.lower() or 'female' in o.query_string.lower())
+        and ('address' in o.query_string.lower() or 'california' in o.query_string.lower())
+        and ('birthdate' in o.query_string.lower() or '1980' in o.query_string.lower()
+             or '1990' in o.query_string.lower()),
+        id="complex",
+    ),
+]
+PATIENT_PROMPTS = [case.values[0] for case in PATIENT_CASES]
+
+
+@pytest.fixture(scope="session")
+def patient_query_outputs(request, patient_query_agent):
+    """Outputs for PATIENT_PROMPTS, built with batched calls instead of one call per test"""
+    if request.config.getoption("--llm-batch"):
+        outputs = patient_query_agent.run_via_batch_api(PATIENT_PROMPTS)
+    else:
+        # Groups of prompts are independent, so send them concurrently
+        outputs = asyncio.run(patient_query_agent.run_batch_async(PATIENT_PROMPTS))
+    return dict(zip(PATIENT_PROMPTS, outputs))
+
+
+@pytest.mark.parametrize("prompt,expected_type,check", PATIENT_CASES)
+def test_create_query_patient(patient_query_outputs, prompt, expected_type, check):
+    """Test query building for each Patient case in PATIENT_CASES"""
+    output = patient_query_outputs[prompt]
+
+    assert isinstance(output, expected_type)
+    assert check(output)
+
+
+def test_validate_query_string(patient_query_agent):
+    """Test that validate flags only parameters unknown for the target type"""
+    assert patient_query_agent.validate("family=Smith&gender:not=male&_count=10") == []
+    assert patient_query_agent.validate(
+        "_has:Observation:patient:code=1234-5&organization.name=Acme"
+    ) == []
+    assert patient_query_agent.validate("favorite-color=blue&family=Smith") == ["favorite-color"]
+    # Leading "?" or "Patient?" prefixes and percent-encoded names
+    assert patient_query_agent.validate("?family=Smith") == []
+    assert patient_query_agent.validate("Patient?birthdate=ge2000&gender=female") == []
+    assert patient_query_agent.validate("family%3Aexact=Smith&given=J%C3%BCrgen") == []
+    assert patient_query_agent.validate("Patient?favorite-color=blue") == ["favorite-color"]
 
 
 # ============================================================================
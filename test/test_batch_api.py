@@ -0,0 +1,155 @@
+"""
+Tests for the Message Batches API helpers
+
+These tests run offline against in-memory result entries:
+- Output tools built by _batch_output_tools
+- Result parsing in _parse_batch_result
+- The polling deadline in run_message_batch
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from fhir_qb import agents
+from fhir_qb.agents import (
+    _batch_output_tools,
+    _parse_batch_result,
+    run_message_batch,
+    SelectedResourceType,
+    SelectTypeError,
+    CreateQueryOutput,
+    CreateQueryError,
+)
+
+
+# ============================================================================
+# Helpers
+# ============================================================================
+
+SELECT_OUTPUT_TYPE = list[SelectedResourceType] | SelectTypeError
+
+
+def _entry(*content, result_type: str = "succeeded", custom_id: str = "prompt-0") -> SimpleNamespace:
+    """A batches.results entry whose message holds the given content blocks"""
+    return SimpleNamespace(
+        custom_id=custom_id,
+        result=SimpleNamespace(type=result_type, message=SimpleNamespace(content=list(content))),
+    )
+
+
+def _tool_use(name: str, tool_input: dict) -> SimpleNamespace:
+    return SimpleNamespace(type="tool_use", name=name, input=tool_input)
+
+
+SELECTION = {"selected_type": "Patient", "confidence": 0.95, "reasoning": "Asks for patients"}
+
+
+# ============================================================================
+# Output Tool Tests
+# ============================================================================
+
+def test_output_tools_for_union():
+    """Test that each union member gets a tool and only list members are wrapped"""
+    tools = _batch_output_tools(SELECT_OUTPUT_TYPE)
+
+    assert {name: wrapped for name, (_, wrapped) in tools.items()} == {
+        "final_result_SelectedResourceTypeList": True,
+        "final_result_SelectTypeError": False,
+    }
+
+
+def test_output_tools_for_models():
+    """Test that model members are passed through unwrapped"""
+    tools = _batch_output_tools(CreateQueryOutput | CreateQueryError)
+
+    assert set(tools) == {"final_result_CreateQueryOutput", "final_result_CreateQueryError"}
+    assert not any(wrapped for _, wrapped in tools.values())
+
+
+# ============================================================================
+# Result Parsing Tests
+# ============================================================================
+
+def test_parse_list_wrapped_response():
+    """Test that a list output is read from under the "response" key"""
+    tools = _batch_output_tools(SELECT_OUTPUT_TYPE)
+    entry = _entry(
+        SimpleNamespace(type="text", text="Thinking..."),
+        _tool_use("final_result_SelectedResourceTypeList", {"response": [SELECTION]}),
+    )
+
+    assert _parse_batch_result(entry, tools) == [SelectedResourceType(**SELECTION)]
+
+
+def test_parse_unwrapped_model():
+    """Test that a model output is validated from the tool input itself"""
+    tools = _batch_output_tools(SELECT_OUTPUT_TYPE)
+    error = {"error": "Unknown type", "reasoning": "XYZ is not a FHIR resource"}
+    entry = _entry(_tool_use("final_result_SelectTypeError", error))
+
+    assert _parse_batch_result(entry, tools) == SelectTypeError(**error)
+
+
+def test_parse_failed_request():
+    """Test that an errored or expired request raises RuntimeError"""
+    with pytest.raises(RuntimeError, match="prompt-3 expired"):
+        _parse_batch_result(_entry(result_type="expired", custom_id="prompt-3"), {})
+
+
+@pytest.mark.parametrize("content", [
+    [SimpleNamespace(type="text", text="No tool call")],
+    [_tool_use("some_other_tool", {"response": [SELECTION]})],
+    [_tool_use("final_result_SelectedResourceTypeList", [SELECTION])],
+])
+def test_parse_missing_output(content):
+    """Test that a response without a usable output tool call raises ValueError"""
+    tools = _batch_output_tools(SELECT_OUTPUT_TYPE)
+
+    with pytest.raises(ValueError):
+        _parse_batch_result(_entry(*content), tools)
+
+
+def test_parse_invalid_output():
+    """Test that output failing validation raises ValueError"""
+    tools = _batch_output_tools(SELECT_OUTPUT_TYPE)
+    entry = _entry(_tool_use(
+        "final_result_SelectedResourceTypeList", {"response": [dict(SELECTION, confidence=2.0)]}
+    ))
+
+    with pytest.raises(ValueError):
+        _parse_batch_result(entry, tools)
+
+
+# ============================================================================
+# Polling Tests
+# ============================================================================
+
+class FakeBatches:
+    """Stand-in for client.messages.batches with a batch that never ends"""
+
+    def __init__(self):
+        self.canceled: list[str] = []
+
+    def create(self, requests):
+        return SimpleNamespace(id="batch-1", processing_status="in_progress")
+
+    def retrieve(self, batch_id):
+        return SimpleNamespace(id=batch_id, processing_status="in_progress")
+
+    def cancel(self, batch_id):
+        self.canceled.append(batch_id)
+
+
+def test_run_message_batch_timeout(monkeypatch):
+    """Test that a batch still running at the deadline is canceled"""
+    anthropic = pytest.importorskip("anthropic")
+    batches = FakeBatches()
+    client = SimpleNamespace(messages=SimpleNamespace(batches=batches))
+    monkeypatch.setattr(anthropic, "Anthropic", lambda: client)
+    monkeypatch.setattr(agents.time, "sleep", lambda seconds: None)
+
+    with pytest.raises(TimeoutError):
+        run_message_batch("model", "system", ["prompt"], SELECT_OUTPUT_TYPE, timeout=0.0)
+
+    assert batches.canceled == ["batch-1"]
@@ -0,0 +1,157 @@
+"""
+Tests for CapabilityStatement parsing
+
+These tests run offline against in-memory responses:
+- Streaming parse with ijson (_stream_capability_statement, _ChunkReader)
+- Parser selection in _read_capability_statement
+"""
+
+import json
+
+import pytest
+
+from fhir_qb import agents
+from fhir_qb.agents import _read_capability_statement, _stream_capability_statement
+
+
+# ============================================================================
+# Helpers
+# ============================================================================
+
+class FakeResponse:
+    """Stand-in for requests.Response serving a fixed body in small chunks"""
+
+    def __init__(self, body: bytes, chunk_size: int = 7, headers: dict[str, str] | None = None):
+        self.content = body
+        self.headers = headers or {}
+        self._chunk_size = chunk_size
+
+    def iter_content(self, chunk_size: int = 1):
+        # Ignore the requested size so reads cross chunk boundaries
+        for start in range(0, len(self.content), self._chunk_size):
+            yield self.content[start:start + self._chunk_size]
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _body(statement: dict) -> bytes:
+    return json.dumps(statement).encode()
+
+
+PATIENT_RESOURCE = {
+    "type": "Patient",
+    "profile": "http://hl7.org/fhir/StructureDefinition/Patient",
+    "interaction": [{"code": "read"}, {"code": "search-type"}],
+    "searchParam": [
+        {"name": "name", "type": "string", "documentation": "A portion of the name"},
+        {"name": "birthdate", "type": "date"},
+    ],
+    "searchInclude": ["Patient:organization"],
+    "searchRevInclude": ["Observation:patient"],
+}
+
+
+# ============================================================================
+# Streaming Parse Tests
+# ============================================================================
+
+def test_stream_keeps_used_fields():
+    """Test that the resource fields fetch_searchable_resources reads are kept"""
+    pytest.importorskip("ijson")
+    statement = {"fhirVersion": "4.0.1", "rest": [{"mode": "server", "resource": [PATIENT_RESOURCE]}]}
+
+    result = _stream_capability_statement(FakeResponse(_body(statement)))
+
+    assert result == statement
+
+
+def test_stream_fields_in_any_order():
+    """Test that resource fields are collected regardless of their order"""
+    pytest.importorskip("ijson")
+    reordered = dict(reversed(list(PATIENT_RESOURCE.items())))
+    statement = {"rest": [{"resource": [reordered], "mode": "server"}], "fhirVersion": "4.0.1"}
+
+    result = _stream_capability_statement(FakeResponse(_body(statement)))
+
+    assert result["fhirVersion"] == "4.0.1"
+    assert result["rest"][0]["mode"] == "server"
+    assert result["rest"][0]["resource"] == [PATIENT_RESOURCE]
+
+
+def test_stream_skips_unused_and_nested_fields():
+    """Test that extensions and other unused fields are dropped, even when they nest kept names"""
+    pytest.importorskip("ijson")
+    resource = dict(PATIENT_RESOURCE, extension=[
+        {"url": "http://example.org/ext", "type": "nested", "searchParam": [{"name": "bogus"}]},
+    ], conditionalCreate=True)
+    statement = {
+        "resourceType": "CapabilityStatement",
+        "software": {"name": "test", "type": "ignored"},
+        "rest": [{"mode": "server", "security": {"cors": True}, "resource": [resource]}],
+    }
+
+    result = _stream_capability_statement(FakeResponse(_body(statement)))
+
+    assert result == {"rest": [{"mode": "server", "resource": [PATIENT_RESOURCE]}]}
+
+
+def test_stream_multiple_rest_entries():
+    """Test that resources stay with their own rest entry"""
+    pytest.importorskip("ijson")
+    client_resource = {"type": "Observation", "interaction": [{"code": "read"}]}
+    statement = {"rest": [
+        {"mode": "client", "resource": [client_resource]},
+        {"mode": "server", "resource": [PATIENT_RESOURCE]},
+    ]}
+
+    result = _stream_capability_statement(FakeResponse(_body(statement)))
+
+    assert result == statement
+
+
+@pytest.mark.parametrize("body", [
+    b'{"rest": [{"mode": "server", "resource": [{"type": "Patient",}]}]}',
+    b'{"rest": [{"mode": "server", "resource": [{"type": "Pat',
+    b'not json',
+])
+def test_stream_malformed_json(body):
+    """Test that malformed or truncated JSON raises ValueError"""
+    pytest.importorskip("ijson")
+
+    with pytest.raises(ValueError):
+        _stream_capability_statement(FakeResponse(body))
+
+
+# ============================================================================
+# Parser Selection Tests
+# ============================================================================
+
+def test_read_prefers_full_parse_for_small_bodies(monkeypatch):
+    """Test that a small body is parsed whole rather than streamed"""
+    pytest.importorskip("ijson")
+    statement = {"fhirVersion": "4.0.1", "rest": [{"mode": "server", "resource": [PATIENT_RESOURCE]}]}
+    response = FakeResponse(_body(statement), headers={"Content-Length": str(len(_body(statement)))})
+
+    def fail(response):
+        raise AssertionError("small bodies should not be streamed")
+
+    monkeypatch.setattr(agents, "_stream_capability_statement", fail)
+    assert _read_capability_statement(response) == statement
+
+    # Without orjson the stdlib parser is used below the threshold
+    monkeypatch.setattr(agents, "orjson", None)
+    assert _read_capability_statement(response) == statement
+
+
+def test_read_streams_large_bodies_without_orjson(monkeypatch):
+    """Test that a body above STREAM_PARSE_MIN_BYTES is streamed when orjson is missing"""
+    pytest.importorskip("ijson")
+    statement = {"rest": [{"mode": "server", "resource": [PATIENT_RESOURCE]}]}
+    response = FakeResponse(_body(statement), headers={"Content-Length": "1000"})
+
+    monkeypatch.setattr(agents, "orjson", None)
+    monkeypatch.setattr(agents, "STREAM_PARSE_MIN_BYTES", 100)
+    monkeypatch.setattr(FakeResponse, "json", lambda self: pytest.fail("large bodies should be streamed"))
+
+    assert _read_capability_statement(response) == statement
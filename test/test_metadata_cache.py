@@ -0,0 +1,237 @@
+"""
+Tests for metadata caching
+
+These tests run offline against a local HTTP server and a temporary cache
+directory:
+- metadata_cache load/store/touch
+- Cache TTL and conditional revalidation in fetch_searchable_resources
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import base64
+import json
+import threading
+
+import pytest
+import requests
+
+from fhir_qb import agents
+from fhir_qb import metadata_cache
+from fhir_qb.agents import fetch_searchable_resources, load_cached_metadata
+from fhir_qb.metadata_cache import CacheInfo
+
+
+# ============================================================================
+# Fixtures
+# ============================================================================
+
+CAPABILITY_STATEMENT = {
+    "resourceType": "CapabilityStatement",
+    "fhirVersion": "4.0.1",
+    "rest": [{
+        "mode": "server",
+        "resource": [{
+            "type": "Patient",
+            "interaction": [{"code": "search-type"}],
+            "searchParam": [{"name": "family", "type": "string"}],
+        }],
+    }],
+}
+
+
+class FakeFHIRServer:
+    """Serves CAPABILITY_STATEMENT at /metadata and records request headers"""
+
+    def __init__(self):
+        self.etag = '"v1"'
+        self.statement = CAPABILITY_STATEMENT
+        self.authorization: str | None = None  # Required Authorization header, if set
+        self.requests: list[dict[str, str]] = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                if server.authorization and self.headers.get("Authorization") != server.authorization:
+                    self.send_response(401)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if self.headers.get("If-None-Match") == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = json.dumps(server.statement).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/fhir+json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", server.etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def fhir_server():
+    """Local FHIR server serving a one-type CapabilityStatement"""
+    server = FakeFHIRServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Point the metadata cache at an empty temporary directory"""
+    monkeypatch.setattr(metadata_cache, "CACHE_DIR", tmp_path / "cache")
+    monkeypatch.delenv(agents.NO_CACHE_ENV_VAR, raising=False)
+    return tmp_path / "cache"
+
+
+def _age_cache_entry(server_url: str) -> None:
+    """Make a cache entry older than the TTL"""
+    data, info = metadata_cache.load(server_url)
+    info.fetched_at = 0.0
+    metadata_cache.store(server_url, data, info)
+
+
+# ============================================================================
+# metadata_cache Tests
+# ============================================================================
+
+def test_store_and_load_round_trip(cache_dir):
+    """Test that stored metadata and sidecar load back unchanged"""
+    info = CacheInfo(etag='"e"', last_modified="Mon, 01 Jan 2024 00:00:00 GMT", version=3, fetched_at=123.0)
+
+    metadata_cache.store("http://example.org/fhir", b'{"x": 1}', info)
+
+    assert metadata_cache.load("http://example.org/fhir") == (b'{"x": 1}', info)
+    assert metadata_cache.load("http://example.org/other") == (None, None)
+    # Atomic writes leave only the two entry files behind
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+def test_load_corrupt_sidecar(cache_dir):
+    """Test that an unreadable sidecar is treated as a missing entry"""
+    metadata_cache.store("http://example.org/fhir", b"{}", CacheInfo())
+    _, info_path = metadata_cache._paths("http://example.org/fhir")
+    info_path.write_text("not json")
+
+    assert metadata_cache.load("http://example.org/fhir") == (None, None)
+
+
+def test_store_failure_is_ignored(cache_dir):
+    """Test that an unwritable cache directory does not raise"""
+    cache_dir.parent.mkdir(parents=True, exist_ok=True)
+    cache_dir.write_text("a file, not a directory")
+
+    metadata_cache.store("http://example.org/fhir", b"{}", CacheInfo())
+    metadata_cache.touch("http://example.org/fhir", CacheInfo())
+
+    assert metadata_cache.load("http://example.org/fhir") == (None, None)
+
+
+def test_touch_marks_entry_fresh(cache_dir):
+    """Test that touch updates fetched_at without rewriting the metadata"""
+    metadata_cache.store("http://example.org/fhir", b'{"x": 1}', CacheInfo(etag='"e"'))
+    data, info = metadata_cache.load("http://example.org/fhir")
+    assert not info.is_fresh()
+
+    metadata_cache.touch("http://example.org/fhir", info)
+
+    data, info = metadata_cache.load("http://example.org/fhir")
+    assert data == b'{"x": 1}'
+    assert info.is_fresh() and info.etag == '"e"'
+
+
+# ============================================================================
+# Fetch Cache Tests
+# ============================================================================
+
+def test_fresh_entry_served_without_network(fhir_server):
+    """Test that a fetch within the TTL does not contact the server"""
+    first = fetch_searchable_resources(fhir_server.url)
+    second = fetch_searchable_resources(fhir_server.url)
+
+    assert len(fhir_server.requests) == 1
+    assert second.same_content(first)
+    assert load_cached_metadata(fhir_server.url, stale_only=True) is None
+    assert load_cached_metadata(fhir_server.url).same_content(first)
+
+
+def test_stale_entry_revalidated_with_304(fhir_server):
+    """Test that a stale entry is revalidated with If-None-Match and reused on 304"""
+    first = fetch_searchable_resources(fhir_server.url)
+    _age_cache_entry(fhir_server.url)
+    assert load_cached_metadata(fhir_server.url, stale_only=True) is not None
+
+    second = fetch_searchable_resources(fhir_server.url)
+
+    assert fhir_server.requests[-1]["If-None-Match"] == fhir_server.etag
+    assert second.same_content(first)
+    assert metadata_cache.load(fhir_server.url)[1].is_fresh()
+
+
+def test_stale_entry_replaced_when_changed(fhir_server):
+    """Test that a 200 on revalidation replaces the cached metadata and ETag"""
+    fetch_searchable_resources(fhir_server.url)
+    _age_cache_entry(fhir_server.url)
+    fhir_server.etag = '"v2"'
+    fhir_server.statement = json.loads(json.dumps(CAPABILITY_STATEMENT))
+    fhir_server.statement["rest"][0]["resource"][0]["type"] = "Practitioner"
+
+    metadata = fetch_searchable_resources(fhir_server.url)
+
+    assert metadata.searchable_types == ["Practitioner"]
+    assert metadata_cache.load(fhir_server.url)[1].etag == '"v2"'
+
+
+def test_refresh_bypasses_fresh_entry(fhir_server):
+    """Test that refresh revalidates a fresh entry and asks caches to revalidate too"""
+    fetch_searchable_resources(fhir_server.url)
+
+    fetch_searchable_resources(fhir_server.url, refresh=True)
+
+    assert len(fhir_server.requests) == 2
+    assert fhir_server.requests[-1]["Cache-Control"] == "max-age=0"
+    assert fhir_server.requests[-1]["If-None-Match"] == fhir_server.etag
+
+
+def test_fresh_entry_requires_valid_credentials(fhir_server):
+    """Test that a fresh entry is not served to a caller the server rejects"""
+    fhir_server.authorization = "Basic " + base64.b64encode(b"user:secret").decode()
+    fetch_searchable_resources(fhir_server.url, "user", "secret")
+
+    with pytest.raises(requests.RequestException, match="401"):
+        fetch_searchable_resources(fhir_server.url, "user", "wrong")
+    with pytest.raises(requests.RequestException, match="401"):
+        fetch_searchable_resources(fhir_server.url)
+
+    assert len(fhir_server.requests) == 3
+    assert load_cached_metadata(fhir_server.url) is None
+
+    # Valid credentials revalidate the entry instead of downloading it again
+    fetch_searchable_resources(fhir_server.url, "user", "secret")
+    assert fhir_server.requests[-1]["If-None-Match"] == fhir_server.etag
+
+
+def test_no_cache_env_var(fhir_server, cache_dir, monkeypatch):
+    """Test that FHIR_QB_NO_CACHE skips reading and writing the cache"""
+    monkeypatch.setenv(agents.NO_CACHE_ENV_VAR, "1")
+
+    fetch_searchable_resources(fhir_server.url)
+    fetch_searchable_resources(fhir_server.url)
+
+    assert len(fhir_server.requests) == 2
+    assert "If-None-Match" not in fhir_server.requests[-1]
+    assert not cache_dir.exists()
+